@@ -3,6 +3,7 @@ from typing import Iterable, Optional, Tuple
 from faster_whisper import WhisperModel
 import os
 import uuid
+import numpy as np
 
 _MODEL: Optional[WhisperModel] = None
 
@@ -18,6 +19,13 @@ def init_asr(model_size: str = "small", device: str = "cpu", compute_type: str =
         # Можно указать свою папку для скачивания моделей:
         # download_root = os.path.join(os.getcwd(), "models_whisper")
         _MODEL = WhisperModel(model_size, device=device, compute_type=compute_type)
+        # Прогрев: 0.5 с тишины, чтобы первая реальная фраза не платила за инициализацию
+        try:
+            segments, _ = _MODEL.transcribe(np.zeros(8000, dtype=np.float32), language="ru",
+                                            beam_size=1, without_timestamps=True)
+            list(segments)
+        except Exception:
+            pass
     return _MODEL
 
 def transcribe_wav(path: str, langs: Iterable[Optional[str]] = ("ru", "en", "no", None)) -> str:
@@ -36,6 +44,28 @@ def transcribe_wav(path: str, langs: Iterable[Optional[str]] = ("ru", "en", "no"
             return txt.lower()
     return ""
 
+def transcribe_pcm16(pcm: bytes, langs: Iterable[Optional[str]] = ("ru", "en", "no", None)) -> str:
+    """
+    Распознаёт уже вырезанный VAD-ом сегмент: 16 кГц, моно, int16 — без WAV/временного файла.
+    Интерактивный режим: жадный поиск, без таймстемпов и без повторного VAD.
+    """
+    assert _MODEL is not None, "ASR model is not initialized. Call init_asr() first."
+    audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+    for lang in langs:
+        segments, _ = _MODEL.transcribe(
+            audio,
+            language=lang,
+            beam_size=1,
+            best_of=1,
+            vad_filter=False,          # сегмент уже прошёл наш VAD
+            without_timestamps=True,
+            condition_on_previous_text=False,
+        )
+        txt = " ".join(s.text for s in segments).strip()
+        if txt:
+            return txt.lower()
+    return ""
+
 def transcribe_bytes(wav_bytes: bytes, langs: Iterable[Optional[str]] = ("ru", "en", "no", None)) -> str:
     """
     Если у тебя поток байтов из микрофона/файла — сохраняем временно и распознаём.
@@ -13,22 +13,23 @@
 
 from __future__ import annotations
 from speech_ru import opening_title_to_speech, san_to_speech, pv_to_speech, apply_san_sequence
+from speech_ru import FILE_RU, DIGIT_RU, PIECE_RU
 from dataclasses import dataclass, field
 from typing import Optional, List, Dict, Any
 from pathlib import Path
 from eco_ru import name_from_eco
-import threading
+import functools
 import time
 import unicodedata
 import chess
 import chess.pgn
-import chess.engine
 import re
 
 from planner import plan_for_fen
 from llm_util import ask
-from name_normalize import match_names
-from engine_core import ENGINE_PATH, fetch_opening_stats
+from name_normalize import build_index, match_against_index
+from engine_core import ENGINE_PATH, EngineSession, fetch_opening_stats
+import eval_cache
 from paths import DATA_DIR, PGN_DIR, ECO_CACHE_FILE, ENGINE_PATH, DB_PATH
 
 PGN_PATH  = str(PGN_DIR)
@@ -45,6 +46,8 @@ THRESH_INACCURACY = 50    # ?!
 THRESH_MISTAKE    = 150   # ?
 THRESH_BLUNDER    = 300   # ??
 ALT_TOL_CP        = 25    # равносильные альтернативы (в пределах 25cp)
+PROGRESS_HZ       = 10    # не чаще стольких строк прогресса в секунду
+EXPLORER_TOP      = 6     # книжных ходов в кэше explorer (один запрос на позицию для любых top_n)
 
 
 # ---------- State containers ----------
@@ -61,25 +64,20 @@ class CoachState:
     opening_announced: bool = False
     last_opening_eco: Optional[str] = None
 
-# ---------- Engine wrapper ----------
+# Rough Cyrillic→Latin map for fuzzy name match (multi-letter targets are fine for str.translate)
+_RU2LAT_TABLE = str.maketrans({
+    "а":"a","б":"b","в":"v","г":"g","д":"d","е":"e","ё":"e","ж":"zh","з":"z","и":"i","й":"y","к":"k",
+    "л":"l","м":"m","н":"n","о":"o","п":"p","р":"r","с":"s","т":"t","у":"u","ф":"f","х":"kh","ц":"ts",
+    "ч":"ch","ш":"sh","щ":"shch","ъ":"","ы":"y","ь":"","э":"e","ю":"yu","я":"ya",
+})
 
-class EngineSession:
-    """Thread-safe wrapper around a single Stockfish process."""
-    def __init__(self, path: str, threads: int = 2, hash_mb: int = 256):
-        self._lock = threading.RLock()
-        self._engine = chess.engine.SimpleEngine.popen_uci(path)
-        self._engine.configure({"Threads": threads, "Hash": hash_mb})
 
-    def analyse(self, board: chess.Board, depth: int = 18, multipv: int = 2):
-        with self._lock:
-            return self._engine.analyse(board, chess.engine.Limit(depth=depth), multipv=multipv)
+# '1.' / '1...' move numbers in a PV string (pv_san_to_speech)
+_RE_PV_MOVENUM = re.compile(r"\d+\.(\.\.)?")
 
-    def quit(self):
-        with self._lock:
-            try:
-                self._engine.quit()
-            except Exception:
-                pass
+# Spellings of the user's name in PGN headers (for _detect_user_side), indexed once
+_ME_INDEX = build_index(["mitusov", "Mitusov", "митусов", "Митусов", "Семен Митусов",
+                         "semen", "семен", "семён", "semen mitusov", "Semen Mitusov"])
 
 
 # ---------- Coach session ----------
@@ -91,20 +89,16 @@ class CoachSession:
         self.state = CoachState()
         self.sf = EngineSession(engine_path)
 
+    def reset(self):
+        """Forget the current game but keep the engine process (and its hash) alive."""
+        self.state = CoachState()
+
     # ===== Name normalization & matching =====
 
     @staticmethod
     def _ru2lat(s: str) -> str:
         """Rough Cyrillic→Latin transliteration for fuzzy name match."""
-        tbl = {
-            "а":"a","б":"b","в":"v","г":"g","д":"d","е":"e","ё":"e","ж":"zh","з":"z","и":"i","й":"y","к":"k",
-            "л":"l","м":"m","н":"n","о":"o","п":"p","р":"r","с":"s","т":"t","у":"u","ф":"f","х":"kh","ц":"ts",
-            "ч":"ch","ш":"sh","щ":"shch","ъ":"","ы":"y","ь":"","э":"e","ю":"yu","я":"ya",
-        }
-        out = []
-        for ch in s.lower():
-            out.append(tbl.get(ch, ch))
-        return "".join(out)
+        return s.lower().translate(_RU2LAT_TABLE)
 
     @staticmethod
     def _norm(s: str) -> str:
@@ -163,8 +157,9 @@ class CoachSession:
     def find_pgn_by_opponent(candidates: List[Path], opponent: str) -> Optional[Path]:
         """
         Search candidate folders for *.pgn that matches opponent in [White]/[Black] tags or filename.
-        Fuzzy, accent-insensitive, Cyrillic-tolerant (via name_normalize.match_names).
+        Fuzzy, accent-insensitive, Cyrillic-tolerant (name_normalize rules; opponent indexed once).
         """
+        opp_index = build_index([opponent])
         found: List[Path] = []
         for d in candidates:
             if not d or not d.exists():
@@ -173,7 +168,7 @@ class CoachSession:
             for p in sorted(d.glob("*.pgn"), key=lambda q: q.stat().st_mtime, reverse=True):
                 try:
                     # 1) по имени файла
-                    if match_names(p.name, opponent):
+                    if match_against_index(p.name, opp_index):
                         found.append(p); continue
                     # 2) по тегам White/Black в заголовке
                     with open(p, "r", encoding="utf-8", errors="ignore") as f:
@@ -182,7 +177,7 @@ class CoachSession:
                         continue
                     w = headers.get("White", "") or ""
                     b = headers.get("Black", "") or ""
-                    if match_names(w, opponent) or match_names(b, opponent):
+                    if match_against_index(w, opp_index) or match_against_index(b, opp_index):
                         found.append(p)
                 except Exception:
                     continue
@@ -198,6 +193,7 @@ class CoachSession:
             raise ValueError("В PGN не нашлось партии.")
         self.state.game = game
         self.state.file_name = str(path)
+        self.sf.new_game(self.state.file_name)  # ucinewgame only when the PGN changes
 
         # Build mainline
         ml: List[chess.pgn.ChildNode] = []
@@ -208,6 +204,15 @@ class CoachSession:
 
         self.state.nodes_mainline = ml
         self.state.board = game.board()
+
+        # Озвучка ходов партии известна заранее — прогреваем кэш san_to_speech
+        b = game.board()
+        for n in ml:
+            try:
+                san_to_speech(b.san(n.move))
+                b.push(n.move)
+            except Exception:
+                break
         self.state.ply_idx = 0
         self.state.user_side = self._detect_user_side()
         self.state.last_branch = None
@@ -220,10 +225,8 @@ class CoachSession:
         h = self.state.game.headers
         w = h.get("White", "") or ""
         b = h.get("Black", "") or ""
-        me_tokens = ["mitusov", "Mitusov", "митусов", "Митусов", "Семен Митусов",
-                    "semen", "семен", "семён", "semen mitusov", "Semen Mitusov"]
-        w_hit = any(match_names(w, t) for t in me_tokens)
-        b_hit = any(match_names(b, t) for t in me_tokens)
+        w_hit = bool(match_against_index(w, _ME_INDEX))
+        b_hit = bool(match_against_index(b, _ME_INDEX))
         if w_hit and not b_hit:
             return True
         if b_hit and not w_hit:
@@ -278,16 +281,8 @@ class CoachSession:
 
     # ===== Branching =====
 
-    def autoplay_to_first_branch(self, min_fullmove: int = 4, max_fullmove: int = 6) -> Dict[str, Any]:
-        """
-        Advance along mainline until first node having parent with multiple variations appears.
-        Prefer a branch within [min_fullmove..max_fullmove]; otherwise take the earliest in the game.
-        Keeps board at the branching point (before the main move).
-        Returns info with 'path_san': list of SAN moves from start to the branching point.
-        """
-        if not self.state.game:
-            return {"error": "no_game"}
-
+    def _branch_index(self, min_fullmove: int, max_fullmove: int) -> int:
+        """Mainline index of the branch autoplay_to_first_branch would stop at."""
         chosen_idx = None
         fallback_idx = None
         b_scan = self.state.game.board()
@@ -303,6 +298,30 @@ class CoachSession:
 
         if chosen_idx is None:
             chosen_idx = fallback_idx if fallback_idx is not None else 0
+        return chosen_idx
+
+    def next_branch_position(self) -> Optional[tuple]:
+        """(board, main move) a 'continue' would move to, without moving (for speculative analysis)."""
+        if not self.state.game:
+            return None
+        ml = self.state.nodes_mainline
+        idx = self._branch_index(self.state.board.fullmove_number + 1, 999)
+        b = self.state.game.board()
+        for node in ml[:idx]:
+            b.push(node.move)
+        return b, (ml[idx].move if idx < len(ml) else None)
+
+    def autoplay_to_first_branch(self, min_fullmove: int = 4, max_fullmove: int = 6) -> Dict[str, Any]:
+        """
+        Advance along mainline until first node having parent with multiple variations appears.
+        Prefer a branch within [min_fullmove..max_fullmove]; otherwise take the earliest in the game.
+        Keeps board at the branching point (before the main move).
+        Returns info with 'path_san': list of SAN moves from start to the branching point.
+        """
+        if not self.state.game:
+            return {"error": "no_game"}
+
+        chosen_idx = self._branch_index(min_fullmove, max_fullmove)
 
         # Build SAN path from start to chosen_idx
         path_san: list[str] = []
@@ -398,12 +417,15 @@ class CoachSession:
 
     def opening_info_current(self, top_n: int = 3) -> dict:
         """
-        Query Lichess explorer for current FEN (fast).
+        Query Lichess explorer for current FEN (fast; cached per position, see eval_cache).
         Returns {"eco":str|None, "name_en":str|None, "name":str|None,
                 "top":[{"san":str,"played":int},...]}
         """
         try:
-            data = fetch_opening_stats(self.state.board.fen(), max_moves=20, top_n=max(1, top_n))
+            board = self.state.board
+            key = eval_cache.make_key("explorer", board, EXPLORER_TOP)
+            data = eval_cache.cached(
+                key, lambda: fetch_opening_stats(board.fen(), max_moves=20, top_n=max(EXPLORER_TOP, top_n)))
             if not data:
                 return {"eco": None, "name_en": None, "name": None, "top": []}
 
@@ -422,22 +444,23 @@ class CoachSession:
         except Exception:
             return {"eco": None, "name_en": None, "name": None, "top": []}
 
-    def first_line_and_equal_alts(self, depth: int = 16, multipv: int = 3) -> dict:
+    def first_line_and_equal_alts(self, depth: int = 16, multipv: int = 3,
+                                  board: Optional[chess.Board] = None, info=None) -> dict:
         """
-        На текущей позиции оценивает 1–3 линии. Возвращает:
+        На текущей позиции (или на board) оценивает 1–3 линии (info — готовый поиск board). Возвращает:
         {
           "best_san": "...",      # первый ход главной линии
           "equal_alts": ["...", "..."]  # альтернативы ~равной силы (<= ALT_TOL_CP)
         }
         """
-        res = self.sf.analyse(self.state.board, depth=depth, multipv=multipv)
+        b = board if board is not None else self.state.board
+        res = info if info is not None else self.sf.analyse(b, depth=depth, multipv=multipv)
         items = res if isinstance(res, list) else [res]
         if not items:
             return {"best_san": "", "equal_alts": []}
 
         # Соберём cp POV белых + SAN первого хода
         lines = []
-        b = self.state.board
         for it in items[:multipv]:
             pv = it.get("pv") or []
             try:
@@ -460,36 +483,44 @@ class CoachSession:
                     eq.append(L["san"])
         return {"best_san": best["san"], "equal_alts": eq[:2]}
 
-    def detect_mistake_on_next_main_move(self, depth: int = 16) -> dict:
-        if not self.state.game:
-            return {"played_san": "", "best_san": "", "cpl": 0, "mark": ""}
-
-        idx = self.state.ply_idx
-        if idx >= len(self.state.nodes_mainline):
-            return {"played_san": "", "best_san": "", "cpl": 0, "mark": ""}
-
-        move_node = self.state.nodes_mainline[idx]
-        pre_board = self.state.board
+    def analyze_branch(self, board: chess.Board, move: Optional[chess.Move], depth: int = 18,
+                       cancel=None) -> dict:
+        """
+        Mistake check of the main move + best line with equal alternatives at a branch point,
+        both from ONE MultiPV search (one engine round-trip instead of two, same hash).
+        cancel: threading.Event for a background run; EngineSession.cancel_search(cancel) aborts it
+        (engine_core.SearchAborted is raised).
+        """
+        info = self.sf.analyse(board, depth=depth, multipv=4, cancel=cancel)
+        if move is not None:
+            mist = self._mistake_at(board, move, depth, info_pre=info, cancel=cancel)
+        else:
+            mist = {"played_san": "", "best_san": "", "cpl": 0, "mark": ""}
+        return {"mist": mist, "opts": self.first_line_and_equal_alts(depth=depth, multipv=3, board=board, info=info)}
 
+    def _mistake_at(self, pre_board: chess.Board, move: chess.Move, depth: int, info_pre=None,
+                    cancel=None) -> dict:
+        """Mistake check of `move` played from `pre_board`; info_pre = ready MultiPV(4) search of pre_board."""
         # --- (A) дебютный фильтр: до 6-го полного хода не ругаем за микропросадки ---
         if pre_board.fullmove_number <= 6:
             try:
-                played_san = pre_board.san(move_node.move)
+                played_san = pre_board.san(move)
             except Exception:
                 played_san = ""
             return {"played_san": played_san, "best_san": "", "cpl": 0, "mark": ""}
 
-        # --- (B) предоценка MultiPV: нужен cp лучшего и cp сыгранного хода ДО выполнения ---
-        info_pre = self.sf.analyse(pre_board, depth=depth, multipv=4)
-        items_pre = info_pre if isinstance(info_pre, list) else [info_pre]
-        best_pre = items_pre[0] if items_pre else None
-        best_cp_stm = self._score_to_cp(pre_board, best_pre.get("score")) if (best_pre and best_pre.get("score") is not None) else 0
-
         try:
-            played_san = pre_board.san(move_node.move)
+            played_san = pre_board.san(move)
         except Exception:
             played_san = ""
 
+        if info_pre is None:
+            # --- (B) предоценка MultiPV: нужен cp лучшего и cp сыгранного хода ДО выполнения ---
+            info_pre = self.sf.analyse(pre_board, depth=depth, multipv=4, cancel=cancel)
+        items_pre = info_pre if isinstance(info_pre, list) else [info_pre]
+        best_pre = items_pre[0] if items_pre else None
+        best_cp_stm = self._score_to_cp(pre_board, best_pre.get("score")) if (best_pre and best_pre.get("score") is not None) else 0
+
         # найдём элемент MultiPV, где первый ход совпадает с сыгранным
         cp_played_pre = None
         played_is_best = False
@@ -512,8 +543,8 @@ class CoachSession:
 
         # --- (C) “пост” оценка после применения хода (для CPL) ---
         mover = (not pre_board.turn)
-        b_after = pre_board.copy(); b_after.push(move_node.move)
-        info_post = self.sf.analyse(b_after, depth=depth, multipv=1)
+        b_after = pre_board.copy(); b_after.push(move)
+        info_post = self.sf.analyse(b_after, depth=depth, multipv=1, cancel=cancel)
         item_post = info_post if isinstance(info_post, dict) else (info_post[0] if info_post else None)
 
         post_cp_for_mover = 0
@@ -551,7 +582,7 @@ class CoachSession:
                     show_progress: bool = True) -> Dict[str, Any]:
         """
         Apply SAN sequence from current position and run deep analysis (default d=23).
-        Progress is printed to stdout at each depth.
+        One search to the target depth; progress goes to stdout at most PROGRESS_HZ times a second.
         """
         b = self.state.board.copy()
         try:
@@ -561,25 +592,28 @@ class CoachSession:
         except Exception as e:
             return {"error": f"Неверная запись варианта: {e}"}
 
-        last_results = []
-        start_depth = 10 if depth >= 10 else depth
-        for d in range(start_depth, depth + 1):
-            res = self.sf.analyse(b, depth=d, multipv=multipv)
-            results = res if isinstance(res, list) else [res]
-            # прогресс
-            if show_progress:
-                try:
-                    pv = results[0].get("pv")
-                except Exception:
-                    pv = None
-                try:
-                    pv_san = b.variation_san((pv or [])[:8]) if pv else ""
-                except Exception:
-                    pv_san = ""
-                print(f"[ANALYZE d{depth}] depth={d:>2} pv={pv_san}")
-            last_results = results
+        last_emit = 0.0
+
+        def progress(info, force: bool = False):
+            nonlocal last_emit
+            now = time.monotonic()
+            if not force and now - last_emit < 1.0 / PROGRESS_HZ:
+                return
+            if info.get("multipv", 1) != 1 or not info.get("pv"):
+                return
+            last_emit = now
+            try:
+                pv_san = b.variation_san(info["pv"][:8])
+            except Exception:
+                pv_san = ""
+            print(f"[ANALYZE d{depth}] depth={info.get('depth', 0):>2} pv={pv_san}")
+
+        results = self.sf.analyse_streaming(b, depth=depth, multipv=multipv,
+                                            on_info=progress if show_progress else None)
+        if show_progress and results:
+            progress(results[0], force=True)
 
-        return {"fen_after": b.fen(), "lines": self._format_lines(b, last_results)}
+        return {"fen_after": b.fen(), "lines": self._format_lines(b, results)}
     # ===== Conversational short answer =====
 
     def coach_reply(self, user_text: str, depth: int = 18) -> str:
@@ -636,14 +670,12 @@ class CoachSession:
     @staticmethod
     def _file_ru(c: str) -> str:
         """Map file letter to spoken Russian."""
-        m = {"a":"а","b":"бэ","c":"це","d":"дэ","e":"е","f":"эф","g":"же","h":"аш"}
-        return m.get(c.lower(), c)
+        return FILE_RU.get(c.lower(), c)
 
     @staticmethod
     def _rank_ru(d: str) -> str:
         """Map rank digit to spoken Russian."""
-        m = {"1":"один","2":"два","3":"три","4":"четыре","5":"пять","6":"шесть","7":"семь","8":"восемь"}
-        return m.get(d, d)
+        return DIGIT_RU.get(d, d)
 
     @classmethod
     def _square_ru(cls, sq: str) -> str:
@@ -655,10 +687,10 @@ class CoachSession:
     @staticmethod
     def _piece_ru(letter: str) -> str:
         """N,B,R,Q,K -> конь, слон, ладья, ферзь, король."""
-        m = {"N":"конь", "B":"слон", "R":"ладья", "Q":"ферзь", "K":"король"}
-        return m.get(letter, "")
+        return PIECE_RU.get(letter, "")
 
     @classmethod
+    @functools.lru_cache(maxsize=4096)  # pure in san; PV narration repeats the same moves
     def san_to_speech(cls, san: str) -> str:
         """
         Convert SAN like 'Nf3', 'Bxd5', 'O-O', 'exd5', 'Qe8=Q+', 'R1e2', 'axb5 e.p.' to spoken RU.
@@ -774,7 +806,7 @@ class CoachSession:
         tokens = []
         for tok in s.split():
             # skip '1.' or '1...' etc
-            if re.fullmatch(r"\d+\.(\.\.)?", tok):
+            if _RE_PV_MOVENUM.fullmatch(tok):
                 continue
             tokens.append(tok)
 
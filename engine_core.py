@@ -1,5 +1,7 @@
 # engine_core.py
 import os, requests
+import atexit
+import threading
 from urllib.parse import quote as _urlq
 import sys, asyncio
 if sys.platform.startswith("win"):
@@ -15,6 +17,113 @@ from paths import ENGINE_PATH
 USE_ONLINE_TABLEBASE = True
 USE_LICHESS_CLOUD = True
 
+
+# ─── долгоживущий процесс Stockfish ─────────────────────────────────────
+def default_threads() -> int:
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+class SearchAborted(Exception):
+    """Прерываемый поиск оборван через cancel — частичный результат не отдаём."""
+
+
+class EngineSession:
+    """
+    Потокобезопасная обёртка над одним процессом Stockfish.
+    Процесс и его хэш-таблица живут между запросами: ucinewgame уходит только
+    при смене партии (new_game), а не перед каждым analyse.
+    """
+    def __init__(self, path: str, threads: int | None = None, hash_mb: int = 512):
+        self._lock = threading.RLock()
+        self._engine = engine.SimpleEngine.popen_uci(path)
+        self._engine.configure({"Threads": threads or default_threads(), "Hash": hash_mb})
+        self._game: object = None      # ключ партии для python-chess (смена → ucinewgame)
+        self.hashfull: int | None = None  # заполненность хэша в промилле после последнего поиска
+        self._running: tuple | None = None  # (cancel, AnalysisResult) идущего прерываемого поиска
+
+    def new_game(self, key: object) -> None:
+        with self._lock:
+            self._game = key
+
+    def analyse(self, board: chess.Board, depth: int = 18, multipv: int = 2,
+                cancel: threading.Event | None = None):
+        """
+        cancel — для фоновых (спекулятивных) поисков: после cancel_search(cancel) поиск
+        останавливается и отдаёт движок, а analyse поднимает SearchAborted.
+        """
+        with self._lock:
+            if cancel is None:
+                info = self._engine.analyse(board, engine.Limit(depth=depth), multipv=multipv, game=self._game)
+            else:
+                info = self._analyse_cancellable(board, depth, multipv, cancel)
+        first = info[0] if isinstance(info, list) and info else info
+        if isinstance(first, dict) and first.get("hashfull") is not None:
+            self.hashfull = first.get("hashfull")
+        return info
+
+    def _analyse_cancellable(self, board: chess.Board, depth: int, multipv: int, cancel: threading.Event):
+        # вызывается под self._lock
+        if cancel.is_set():
+            raise SearchAborted()
+        with self._engine.analysis(board, engine.Limit(depth=depth), multipv=multipv, game=self._game) as an:
+            self._running = (cancel, an)
+            try:
+                if cancel.is_set():  # отменили между проверкой выше и регистрацией
+                    an.stop()
+                an.wait()
+            finally:
+                self._running = None
+            if cancel.is_set():
+                raise SearchAborted()
+            return [dict(x) for x in an.multipv]
+
+    def cancel_search(self, cancel: threading.Event) -> None:
+        """Отменить прерываемые поиски с этим cancel: идущий останавливается, следующие не стартуют."""
+        cancel.set()
+        running = self._running
+        if running is not None and running[0] is cancel:
+            try:
+                running[1].stop()
+            except Exception:
+                pass
+
+    def analyse_streaming(self, board: chess.Board, depth: int, multipv: int = 1, on_info=None):
+        """
+        Один поиск до depth; on_info(info) получает промежуточные info-строки движка.
+        Возвращает список InfoDict по линиям, как analyse(..., multipv=N).
+        """
+        with self._lock:
+            with self._engine.analysis(board, engine.Limit(depth=depth), multipv=multipv, game=self._game) as an:
+                for info in an:
+                    if on_info is not None:
+                        on_info(info)
+                an.wait()
+                lines = [dict(x) for x in an.multipv]
+        if lines and lines[0].get("hashfull") is not None:
+            self.hashfull = lines[0].get("hashfull")
+        return lines
+
+    def quit(self):
+        with self._lock:
+            try:
+                self._engine.quit()
+            except Exception:
+                pass
+
+
+_shared: EngineSession | None = None
+_shared_lock = threading.Lock()
+
+
+def shared_engine() -> EngineSession:
+    """Один Stockfish на процесс для analyze_fen*/kb — без запуска движка на каждый запрос."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = EngineSession(str(ENGINE_PATH), hash_mb=256)
+            atexit.register(_shared.quit)
+        return _shared
+
 def _try_tablebase(fen: str):
     """Вернёт dict(eval, best, pv, depth, source) либо None."""
     board = chess.Board(fen)
@@ -186,9 +295,33 @@ def analyze_fen(fen: str, depth: int = 18) -> dict:
     pv   — короткий вариант (до 5 ходов).
     """
     board = chess.Board(fen)
-    with engine.SimpleEngine.popen_uci(str(ENGINE_PATH)) as sf:
-        info = sf.analyse(board, engine.Limit(depth=depth), multipv=1)
+    info = shared_engine().analyse(board, depth=depth, multipv=1)
+    return _info_to_result(board, info, depth)
+
+
+def analyze_fen_progressive(fen: str, depths=(10, 14, 18), on_update=None,
+                            cancel: threading.Event | None = None) -> dict:
+    """
+    Итеративное углубление на общем процессе Stockfish, глубины по возрастанию
+    (хэш-таблица движка переживает вызовы, каждая следующая глубина дешевле).
+    on_update(result) вызывается после каждой глубины; возвращается последний результат
+    в формате analyze_fen. cancel — как в EngineSession.analyse (SearchAborted).
+    """
+    board = chess.Board(fen)
+    res: dict = {}
+    sf = shared_engine()
+    for d in depths:
+        info = sf.analyse(board, depth=d, multipv=1, cancel=cancel)
+        res = _info_to_result(board, info, d)
+        if on_update is not None:
+            try:
+                on_update(res)
+            except Exception:
+                pass
+    return res
+
 
+def _info_to_result(board: chess.Board, info, depth: int) -> dict:
     # python-chess может вернуть dict или объект
     if isinstance(info, list):
         info = info[0]
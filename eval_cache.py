@@ -0,0 +1,115 @@
+# eval_cache.py — кэш результатов движка по позиции: LRU в памяти + SQLite между сессиями
+from __future__ import annotations
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+import chess
+import chess.polyglot
+from paths import DB_PATH
+
+MAX_ITEMS = 4096   # записей в памяти
+
+_mem: "OrderedDict[str, Any]" = OrderedDict()
+_lock = threading.Lock()
+
+_db_lock = threading.Lock()
+_db_conn: sqlite3.Connection | None = None
+
+# запись на диск — в фоне, чтобы не тормозить голосовой цикл
+_writes: "queue.Queue[tuple[str, str]]" = queue.Queue()
+_writer: threading.Thread | None = None
+
+
+def position_key(board: chess.Board) -> str:
+    """
+    Zobrist-хэш (Polyglot) позиции: без счётчиков ходов, транспозиции совпадают,
+    и не нужно собирать FEN-строку. 64 бита стабильны между запусками — годится для SQLite.
+    """
+    return f"{chess.polyglot.zobrist_hash(board):016x}"
+
+
+def make_key(kind: str, board: chess.Board, *params: Any) -> str:
+    return "|".join([kind, position_key(board), *map(str, params)])
+
+
+def _db() -> sqlite3.Connection:
+    global _db_conn
+    if _db_conn is None:
+        conn = sqlite3.connect(str(DB_PATH), check_same_thread=False, timeout=5.0)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS eval_cache ("
+            " key TEXT PRIMARY KEY, result TEXT, ts REAL)"
+        )
+        conn.commit()
+        _db_conn = conn
+    return _db_conn
+
+
+def _writer_loop() -> None:
+    while True:
+        key, payload = _writes.get()
+        try:
+            with _db_lock:
+                conn = _db()
+                conn.execute(
+                    "INSERT OR REPLACE INTO eval_cache(key, result, ts) VALUES (?, ?, ?)",
+                    (key, payload, time.time()),
+                )
+                conn.commit()
+        except Exception:
+            pass
+
+
+def _remember(key: str, value: Any) -> None:
+    with _lock:
+        _mem[key] = value
+        _mem.move_to_end(key)
+        while len(_mem) > MAX_ITEMS:
+            _mem.popitem(last=False)
+
+
+def get(key: str) -> Optional[Any]:
+    with _lock:
+        if key in _mem:
+            _mem.move_to_end(key)
+            return _mem[key]
+    try:
+        with _db_lock:
+            row = _db().execute("SELECT result FROM eval_cache WHERE key=?", (key,)).fetchone()
+    except Exception:
+        return None
+    if not row:
+        return None
+    try:
+        value = json.loads(row[0])
+    except Exception:
+        return None
+    _remember(key, value)
+    return value
+
+
+def put(key: str, value: Any) -> None:
+    global _writer
+    _remember(key, value)
+    try:
+        payload = json.dumps(value, ensure_ascii=False)
+    except (TypeError, ValueError):
+        return  # не сериализуется — держим только в памяти
+    if _writer is None:
+        _writer = threading.Thread(target=_writer_loop, daemon=True)
+        _writer.start()
+    _writes.put((key, payload))
+
+
+def cached(key: str, compute: Callable[[], Any]) -> Any:
+    """Вернуть из кэша или посчитать; пустые результаты не кэшируются."""
+    value = get(key)
+    if value is None:
+        value = compute()
+        if value:
+            put(key, value)
+    return value
@@ -12,7 +12,15 @@ def _conn():
     return sqlite3.connect(DB_PATH)
 
 def _fen4(fen: str) -> str:
-    return " ".join(fen.split()[:4])  # первые 4 поля FEN
+    # первые 4 поля FEN; partition вместо split() — без промежуточного списка
+    a, _, rest = fen.strip().partition(" ")
+    b, _, rest = rest.partition(" ")
+    c, _, rest = rest.partition(" ")
+    d, _, _ = rest.partition(" ")
+    if not (b and c and d):
+        # неполный FEN или лишние пробелы — медленный, но точный путь
+        return " ".join(fen.split()[:4])
+    return f"{a} {b} {c} {d}"
 
 def _sort_rows(rows):
     return rows
@@ -278,10 +286,9 @@ def pick_rook_4v3_candidate() -> Optional[Dict[str, Any]]:
 # === [/ADDED] ===
 # --- оставить как есть: GOOD_NAGS/BAD_NAGS/_sort_rows/_conn/_fen4 ---
 
-def find_exact_by_fen(fen: str, limit=8):
-    prefix = _fen4(fen) + " "
-    con=_conn(); cur=con.cursor()
-    cur.execute("""
+# SQL с «зашитым» LIMIT для типовых значений (auto_query: limit=8 → limit*3=24).
+# Общая форма с LIMIT ? остаётся для нестандартных лимитов.
+_SQL_EXACT = """
       SELECT positions.fen, positions.phase, positions.comment,
              games.white, games.black, games.result, games.eco, games.opening,
              COALESCE(positions.is_mainline,0) AS is_mainline,
@@ -290,14 +297,9 @@ def find_exact_by_fen(fen: str, limit=8):
       FROM positions JOIN games USING(game_id)
       WHERE positions.fen LIKE ?
       ORDER BY is_mainline DESC, positions.ply ASC
-      LIMIT ?;
-    """, (prefix+"%", limit))
-    rows=cur.fetchall(); con.close(); return rows
-
-def find_similar_endgame_by_material(fen: str, limit=8):
-    board=chess.Board(fen); msig= material_signature(board)
-    con=_conn(); cur=con.cursor()
-    cur.execute("""
+      LIMIT {limit};
+"""
+_SQL_MSIG = """
       SELECT positions.fen, positions.phase, positions.comment,
              games.white, games.black, games.result, games.eco, games.opening,
              COALESCE(positions.is_mainline,0) AS is_mainline,
@@ -306,8 +308,36 @@ def find_similar_endgame_by_material(fen: str, limit=8):
       FROM positions JOIN games USING(game_id)
       WHERE positions.phase='endgame' AND positions.material_signature=?
       ORDER BY is_mainline DESC, positions.ply ASC
-      LIMIT ?;
-    """, (msig, limit))
+      LIMIT {limit};
+"""
+SQL_EXACT_GENERIC = _SQL_EXACT.format(limit="?")
+SQL_EXACT_8  = _SQL_EXACT.format(limit=8)
+SQL_EXACT_24 = _SQL_EXACT.format(limit=24)
+SQL_MSIG_GENERIC = _SQL_MSIG.format(limit="?")
+SQL_MSIG_24 = _SQL_MSIG.format(limit=24)
+
+_SQL_EXACT_BY_LIMIT = {8: SQL_EXACT_8, 24: SQL_EXACT_24}
+_SQL_MSIG_BY_LIMIT = {24: SQL_MSIG_24}
+
+def _specialized(table: dict, generic: str, params: tuple, limit):
+    """(sql, params): готовый SQL под данный limit или общий с LIMIT ?."""
+    sql = table.get(limit)
+    if sql is not None:
+        return sql, params
+    return generic, params + (limit,)
+
+def find_exact_by_fen(fen: str, limit=8):
+    prefix = _fen4(fen) + " "
+    sql, params = _specialized(_SQL_EXACT_BY_LIMIT, SQL_EXACT_GENERIC, (prefix+"%",), limit)
+    con=_conn(); cur=con.cursor()
+    cur.execute(sql, params)
+    rows=cur.fetchall(); con.close(); return rows
+
+def find_similar_endgame_by_material(fen: str, limit=8):
+    board=chess.Board(fen); msig= material_signature(board)
+    sql, params = _specialized(_SQL_MSIG_BY_LIMIT, SQL_MSIG_GENERIC, (msig,), limit)
+    con=_conn(); cur=con.cursor()
+    cur.execute(sql, params)
     rows=cur.fetchall(); con.close(); return rows
 
 def find_opening_by_eco_prefix(eco: str, limit=12):
@@ -339,4 +369,3 @@ def auto_query(fen: str, limit=8):
     except Exception:
         pass
     return {"mode":"none", "rows":[]}
-
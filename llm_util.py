@@ -1,4 +1,10 @@
 import requests, json
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Iterator
+from paths import DB_PATH
 
 SYSTEM = (
     "Ты русский шахматный тренер-гроссмейстер. "
@@ -7,14 +13,162 @@ SYSTEM = (
     "профилактика, перевести ладью, вскрыть линию, упрощение, цейтнот и т.п."
 )
 
+OLLAMA_URL = "http://localhost:11434/api/generate"
+MODEL = "llama3:8b"
+
+# Таймауты HTTP (сек): соединение, чтение ответа. Короткий connect — быстро узнаём, что Ollama не поднята
+TIMEOUT = (2.0, 120.0)
+# Повторы при сбоях Ollama: паузы между попытками (сек), не больше 3 повторов
+RETRY_BACKOFF = (0.2, 0.5, 1.0)
+# Предохранитель: после BREAKER_FAILS неудач подряд не ходим в LLM BREAKER_COOLDOWN секунд
+BREAKER_FAILS = 3
+BREAKER_COOLDOWN = 30.0
+
+_breaker_lock = threading.Lock()
+_consecutive_fails = 0
+_open_until = 0.0
+
+
+# Дисковый кэш ответов: ключ = blake2b(model, SYSTEM, prompt)
+_cache_lock = threading.Lock()
+_cache_conn: sqlite3.Connection | None = None
+
+
+def _cache() -> sqlite3.Connection:
+    global _cache_conn
+    if _cache_conn is None:
+        conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, response BLOB, ts REAL)"
+        )
+        conn.commit()
+        _cache_conn = conn
+    return _cache_conn
+
+
+def _cache_key(model: str, user_prompt: str) -> str:
+    return hashlib.blake2b(f"{model}\0{SYSTEM}\0{user_prompt}".encode("utf-8")).hexdigest()
+
+
+def _cache_get(key: str) -> str | None:
+    try:
+        with _cache_lock:
+            row = _cache().execute("SELECT response FROM llm_cache WHERE key=?", (key,)).fetchone()
+    except Exception:
+        return None
+    if not row:
+        return None
+    val = row[0]
+    return val.decode("utf-8") if isinstance(val, bytes) else val
+
+
+def _cache_put(key: str, text: str) -> None:
+    try:
+        with _cache_lock:
+            conn = _cache()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache(key, response, ts) VALUES (?, ?, ?)",
+                (key, text.encode("utf-8"), time.time()),
+            )
+            conn.commit()
+    except Exception:
+        pass
+
+
+class LLMUnavailable(RuntimeError):
+    """LLM недоступна (предохранитель разомкнут) — вызывающий код уходит в свой фолбэк."""
+
+
+def _is_retryable(exc: Exception) -> bool:
+    # ConnectTimeout — подкласс ConnectionError. ReadTimeout не повторяем:
+    # зависшая генерация повторилась бы на полный таймаут чтения ещё до трёх раз
+    if isinstance(exc, requests.ConnectionError):
+        return True
+    if isinstance(exc, requests.HTTPError):
+        resp = exc.response
+        return resp is not None and resp.status_code >= 500
+    return False
+
+
+def _post(payload: dict) -> str:
+    r = requests.post(OLLAMA_URL, data=json.dumps(payload), timeout=TIMEOUT)
+    r.raise_for_status()
+    return r.json()["response"].strip()
+
+
+def _breaker_check() -> None:
+    with _breaker_lock:
+        if _open_until and time.monotonic() < _open_until:
+            raise LLMUnavailable("LLM временно недоступна (circuit breaker).")
+
+
+def _breaker_record(ok: bool) -> None:
+    global _consecutive_fails, _open_until
+    with _breaker_lock:
+        if ok:
+            _consecutive_fails = 0
+            _open_until = 0.0
+            return
+        _consecutive_fails += 1
+        if _consecutive_fails >= BREAKER_FAILS:
+            _open_until = time.monotonic() + BREAKER_COOLDOWN
+
 
 def ask(user_prompt: str) -> str:
+    key = _cache_key(MODEL, user_prompt)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    _breaker_check()
     payload = {
-        "model": "llama3:8b",
+        "model": MODEL,
         "prompt": f"{SYSTEM}\n\n{user_prompt}",
         "stream": False
     }
-    r = requests.post("http://localhost:11434/api/generate",
-                      data=json.dumps(payload), timeout=120)
-    r.raise_for_status()
-    return r.json()["response"].strip()
+    delays = (0.0,) + tuple(RETRY_BACKOFF)
+    for attempt, delay in enumerate(delays):
+        if delay:
+            time.sleep(delay)
+        try:
+            text = _post(payload)
+        except Exception as e:
+            if _is_retryable(e) and attempt < len(delays) - 1:
+                continue
+            _breaker_record(False)
+            raise
+        _breaker_record(True)
+        if text:
+            _cache_put(key, text)
+        return text
+
+
+def ask_stream(user_prompt: str) -> Iterator[str]:
+    """
+    Потоковый вариант ask(): отдаёт текст по мере генерации.
+    Если вызывающий прекращает итерацию, соединение закрывается и Ollama останавливает генерацию.
+    Без кэша и повторов — для коротких служебных запросов (разбор намерений).
+    """
+    _breaker_check()
+    payload = {
+        "model": MODEL,
+        "prompt": f"{SYSTEM}\n\n{user_prompt}",
+        "stream": True
+    }
+    try:
+        r = requests.post(OLLAMA_URL, data=json.dumps(payload), timeout=TIMEOUT, stream=True)
+        r.raise_for_status()
+    except Exception:
+        _breaker_record(False)
+        raise
+    _breaker_record(True)
+    with r:
+        for line in r.iter_lines():
+            if not line:
+                continue
+            part = json.loads(line)
+            tok = part.get("response") or ""
+            if tok:
+                yield tok
+            if part.get("done"):
+                break
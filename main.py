@@ -3,6 +3,8 @@
 # OS: Windows (using PowerShell/COM for audio)
 import chess
 import pyaudio, audioop, wave, io, collections
+import array
+import mmap
 import os
 import re
 import time, json
@@ -10,27 +12,37 @@ import queue
 import tempfile
 import threading
 import subprocess
+import atexit
+import concurrent.futures
+import functools
 import webbrowser
 import unicodedata
 import tkinter as tk
 from tkinter.scrolledtext import ScrolledText
 from tkinter import filedialog, messagebox, StringVar, ttk
 from pathlib import Path
-from typing import Optional, Any, Tuple, List, Dict
-from asr_backend import init_asr, transcribe_wav
+from dataclasses import dataclass
+from typing import Optional, Any, Callable, Tuple, List, Dict
+from asr_backend import init_asr, transcribe_pcm16
 from coach_session import CoachSession
-from engine_core import ENGINE_PATH, analyze_fen
-from speech_ru import strip_move_numbers, san_to_speech, pv_to_speech, opening_title_to_speech
+from engine_core import ENGINE_PATH, analyze_fen_progressive, shared_engine
+import eval_cache
+from speech_ru import san_to_speech, pv_to_speech, opening_title_to_speech
 from paths import ensure_dirs, ROOT, DATA_DIR, PGN_DIR, ECO_CACHE_FILE, ENGINE_PATH, DB_PATH
 ensure_dirs()
 
 
 # ---------- LLM ----------
-from llm_util import ask
+from llm_util import ask_stream
 
 # ---------- ASR: faster-whisper ----------
 from faster_whisper import WhisperModel
 
+try:
+    import numpy as np   # comes with faster-whisper; used for block-wise VAD RMS
+except Exception:
+    np = None
+
 _ASR = None
 _CALIB_PATH = Path.home() / ".ai_chess_eta_calib.json"
 
@@ -51,8 +63,24 @@ ANALYSIS_DIRS = [
 ANALYSIS_DIRS = [p for p in ANALYSIS_DIRS if p]  # drop Nones
 
 _RE_JUST_ASK_CORRECT = re.compile(r"\b(как\s+было\s+правильно|что\s+нужно\s+было|какой\s+правильный\s+ход)\b", re.IGNORECASE)
-# Примитивный детектор одного SAN-хода внутри фразы (O-O, O-O-O, фигуры/пешки)
-_RE_SAN_IN_TEXT = re.compile(r"\b(O-O(-O)?|[KQRBN]?[a-h]?[1-8]?x?[a-h][1-8](?:=[QRBN])?[+#]?)\b", re.IGNORECASE)
+# Примитивный детектор одного SAN-хода внутри фразы (O-O, O-O-O, фигуры/пешки).
+# Ветки не пересекаются по первому символу: рокировка, фигура, пешка — меньше откатов.
+_RE_SAN_IN_TEXT = re.compile(
+    r"\b(?:O-O-O|O-O"
+    r"|[KQRBN][a-h]?[1-8]?x?[a-h][1-8]"
+    r"|[a-h](?:[1-8]?x?[a-h])?[1-8](?:=[QRBN])?)[+#]?\b",
+    re.IGNORECASE,
+)
+# Рокировка словами: одна проверка вместо двух re.search подряд
+_RE_CASTLE_WORDS = re.compile(r"(?P<short>коротк\w*\s+рокиров)|(?P<long>длинн\w*\s+рокиров)", re.IGNORECASE)
+_RE_WANTS_ANALYSIS = re.compile(r"\b(вариант|посмотр(им|и)|посмотри|покажи)\b", re.IGNORECASE)
+_RE_VS = re.compile(r"\bпротив\b", re.IGNORECASE)
+
+def castling_from_words(text: str) -> str | None:
+    m = _RE_CASTLE_WORDS.search(text or "")
+    if not m:
+        return None
+    return "O-O" if m.lastgroup == "short" else "O-O-O"
 
 def maybe_extract_san(text: str) -> str | None:
     m = _RE_SAN_IN_TEXT.search(text or "")
@@ -69,11 +97,9 @@ def extract_variant_san(text: str, data: dict, board: chess.Board) -> str:
     if san:
         return san
 
-    t = (text or "").lower()
-    if re.search(r"коротк\w*\s+рокиров", t, re.IGNORECASE):
-        return "O-O"
-    if re.search(r"длинн\w*\s+рокиров", t, re.IGNORECASE):
-        return "O-O-O"
+    castle = castling_from_words(text)
+    if castle:
+        return castle
 
     uci_list = data.get("moves_uci") or []
     if uci_list:
@@ -88,40 +114,100 @@ def extract_variant_san(text: str, data: dict, board: chess.Board) -> str:
 def is_ask_how_correct(text: str) -> bool:
     return bool(_RE_JUST_ASK_CORRECT.search(text or ""))
 
+# Калибровка ETA держится в памяти; на диск — при выходе или каждые _CALIB_FLUSH_EVERY обновлений
+_CALIB_CACHE: dict | None = None
+_CALIB_DIRTY = 0
+_CALIB_FLUSH_EVERY = 5
+_CALIB_LOCK = threading.Lock()
+
 def _load_eta_calib():
-    if _CALIB_PATH.exists():
+    global _CALIB_CACHE
+    if _CALIB_CACHE is not None:
+        return _CALIB_CACHE
+    with _CALIB_LOCK:
+        if _CALIB_CACHE is None:
+            data = None
+            if _CALIB_PATH.exists():
+                try:
+                    data = json.loads(_CALIB_PATH.read_text(encoding="utf-8"))
+                except Exception:
+                    pass
+            if not isinstance(data, dict):
+                # Стартовые параметры, близкие к твоим замерам:
+                # r ~ 1.36 на +1 ply глубины, base_per_ply_15 ~ 0.40 c/полуход при depth=15, MultiPV=3
+                data = {"r": 1.44, "alpha_mpv": 0.95, "base_per_ply_15": 0.40, "t0": 20.0}
+            _CALIB_CACHE = data
+    return _CALIB_CACHE
+
+def _flush_eta_calib():
+    global _CALIB_DIRTY
+    with _CALIB_LOCK:
+        if not _CALIB_DIRTY or _CALIB_CACHE is None:
+            return
         try:
-            return json.loads(_CALIB_PATH.read_text(encoding="utf-8"))
+            tmp = _CALIB_PATH.with_suffix(".tmp")
+            tmp.write_text(json.dumps(_CALIB_CACHE, ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp, _CALIB_PATH)
+            _CALIB_DIRTY = 0
         except Exception:
             pass
-    # Стартовые параметры, близкие к твоим замерам:
-    # r ~ 1.36 на +1 ply глубины, base_per_ply_15 ~ 0.40 c/полуход при depth=15, MultiPV=3
-    return {"r": 1.44, "alpha_mpv": 0.95, "base_per_ply_15": 0.40, "t0": 20.0}
+
+atexit.register(_flush_eta_calib)
 
 def _save_eta_calib(data: dict):
-    try:
-        _CALIB_PATH.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    except Exception:
-        pass
+    global _CALIB_CACHE, _CALIB_DIRTY
+    with _CALIB_LOCK:
+        _CALIB_CACHE = data
+        _CALIB_DIRTY += 1
+        flush = _CALIB_DIRTY >= _CALIB_FLUSH_EVERY
+    if flush:
+        _flush_eta_calib()
+
+# Быстрый подсчёт полуходов без разбора PGN: файл через mmap, декодируем только ходы первой партии,
+# убираем комментарии/варианты, считаем SAN-токены
+_RE_PGN_TAG_LINE_B = re.compile(rb"[ \t]*\[[^\]\n]*\][ \t\r]*$", re.M)
+_RE_PGN_NEXT_TAG_B = re.compile(rb"\n[ \t]*\[[^\]\n]*\][ \t\r]*$", re.M)
+_RE_PGN_NONBLANK_B = re.compile(rb"\S")
+_RE_PGN_FULLMOVE_B = re.compile(rb"\b\d+\.")
+_RE_PGN_COMMENT = re.compile(r"\{[^}]*\}|;[^\n]*")
+_RE_PGN_VARIATION = re.compile(r"\([^()]*\)")
+_RE_PGN_SAN_TOKEN = re.compile(r"(?:O-O(?:-O)?|0-0(?:-0)?|[KQRBN]?[a-h]?[1-8]?x?[a-h][1-8](?:=?[QRBN])?)[+#]?[!?]*")
+_RE_PGN_MOVENUM = re.compile(r"\d+\.(?:\.\.)?")
+
+def _pgn_first_movetext(mm) -> Optional[str]:
+    """Ходы первой партии (как chess.pgn.read_game): после заголовков и до следующей строки-тега."""
+    start = 3 if mm[:3] == b"\xef\xbb\xbf" else 0
+    pos = start
+    while True:
+        m = _RE_PGN_NONBLANK_B.search(mm, pos)
+        if m is None:
+            return None
+        line_start = max(start, mm.rfind(b"\n", 0, m.start()) + 1)
+        tag = _RE_PGN_TAG_LINE_B.match(mm, line_start)
+        if tag is None:
+            break
+        pos = tag.end()
+    end = _RE_PGN_NEXT_TAG_B.search(mm, line_start)
+    return mm[line_start:end.start() if end else len(mm)].decode("utf-8", errors="ignore")
 
 def count_plies_in_pgn(path: str | Path) -> int:
     try:
-        import chess.pgn
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            game = chess.pgn.read_game(f)
-        if game:
-            return sum(1 for _ in game.mainline())
-    except Exception:
-        pass
-    # страховка: оценим по числу полных ходов
-    try:
-        import re
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            txt = f.read(200_000)
-        fullmoves = len(re.findall(r"\b\d+\.", txt))
-        return max(10, min(400, (fullmoves or 30) * 2))
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            body = _pgn_first_movetext(mm)
+            if body is None:
+                # страховка: оценим по числу полных ходов
+                fullmoves = len(_RE_PGN_FULLMOVE_B.findall(mm, 0, 200_000))
+                return max(10, min(400, (fullmoves or 30) * 2))
     except Exception:
         return 60
+    body = _RE_PGN_COMMENT.sub(" ", body)
+    while True:
+        stripped = _RE_PGN_VARIATION.sub(" ", body)
+        if stripped == body:
+            break
+        body = stripped
+    body = _RE_PGN_MOVENUM.sub(" ", body)
+    return sum(1 for tok in body.split() if _RE_PGN_SAN_TOKEN.fullmatch(tok))
 
 def eta_predict_seconds(plies: int, depth: int, multipv: int, pvlen: int) -> int:
     """
@@ -139,10 +225,30 @@ def eta_predict_seconds(plies: int, depth: int, multipv: int, pvlen: int) -> int
     seconds = t0 + base * float(plies) * scale_depth * scale_mpv
     return int(max(1, seconds))
 
-def eta_update_calibration_after_run(plies: int, depth: int, multipv: int, elapsed_sec: float):
+ETA_MAX_SAMPLES = 1024   # (frac, elapsed) progress samples kept per run for the calibration fit
+
+def _eta_fit_samples(samples: Optional["array.array"]) -> Optional[Tuple[float, float]]:
+    """
+    Least-squares line elapsed = t0 + slope * frac over the run's progress samples
+    (interleaved frac, elapsed doubles). Returns (t0, slope) or None if numpy/samples are missing.
+    """
+    if np is None or samples is None or len(samples) < 16:
+        return None
+    xy = np.frombuffer(samples, dtype=np.float64).reshape(-1, 2)
+    frac, t = xy[:, 0], xy[:, 1]
+    if float(np.ptp(frac)) < 0.5:
+        return None
+    slope, intercept = np.polyfit(frac, t, 1)
+    if not slope > 0:
+        return None
+    return max(0.0, float(intercept)), float(slope)
+
+def eta_update_calibration_after_run(plies: int, depth: int, multipv: int, elapsed_sec: float,
+                                     samples: Optional["array.array"] = None):
     """
     Update ETA calibration after a finished run.
     Now we also estimate 'r' (depth growth factor) from the observed time.
+    With progress samples, t0 and base come from a linear fit instead of the single total.
     """
     C = _load_eta_calib()
     r = float(C.get("r", 1.44))
@@ -154,9 +260,15 @@ def eta_update_calibration_after_run(plies: int, depth: int, multipv: int, elaps
     denom_mpv_plies = ((max(1, multipv) / 3.0) ** alpha) * max(1, plies)
     depth_power = max(0, (depth - 15))
 
-    # Recompute base/t0 using current r
-    measured_t0 = max(0.0, elapsed_sec - old_base * (r ** depth_power) * denom_mpv_plies)
-    measured_base = max(0.0, (elapsed_sec - old_t0) / ((r ** depth_power) * denom_mpv_plies))
+    fit = _eta_fit_samples(samples)
+    if fit is not None:
+        # intercept = warm-up before the first ply, slope = search time of the whole game
+        measured_t0, search_sec = fit
+        measured_base = search_sec / ((r ** depth_power) * denom_mpv_plies)
+    else:
+        # Recompute base/t0 using current r
+        measured_t0 = max(0.0, elapsed_sec - old_base * (r ** depth_power) * denom_mpv_plies)
+        measured_base = max(0.0, (elapsed_sec - old_t0) / ((r ** depth_power) * denom_mpv_plies))
 
     # One-run estimate for r if depth != 15 and numbers are sane
     r_est = r
@@ -197,6 +309,10 @@ _VAD_END_MS = 700
 _VAD_MAX_SEG_SEC = 30
 _VAD_PREROLL_MS = 600
 _VAD_MIN_SEG_MS = 450
+# how many VAD frames to read from the device per call (RMS is computed for all at once)
+_VAD_BLOCK_FRAMES = 4
+# frames used to bootstrap the noise floor before speech detection starts (~150 ms)
+_VAD_BOOTSTRAP_FRAMES = 5
 
 def _frames_per_buffer():
     return int(_VAD_SAMPLE_RATE * _VAD_FRAME_MS / 1000)
@@ -213,119 +329,177 @@ def _pcm16_to_wav_bytes(pcm: bytes, sr: int = _VAD_SAMPLE_RATE) -> bytes:
         wf.writeframes(pcm)
     return bio.getvalue()
 
-def _calibrate_threshold(stream, seconds=1.0, floor=250, mult=1.7):
-    n_frames = int((seconds * 1000) / _VAD_FRAME_MS)
-    vals = []
-    for _ in range(n_frames):
-        raw = stream.read(_frames_per_buffer(), exception_on_overflow=False)
-        vals.append(audioop.rms(raw, _VAD_SAMPLE_WIDTH))
-    base = sum(vals) / max(1, len(vals))
-    return max(int(base * mult), floor)
-
-def _stream_segments(
-    stop_event: Optional[threading.Event] = None,
-    device_index: Optional[int] = None,
-):
-    """PCM speech segment generator (bytes) with auto start/stop on silence."""
-    pa = pyaudio.PyAudio()
+def _frames_rms(raw: bytes, frame_len: int) -> List[int]:
+    """RMS of each frame_len-sample frame in raw (int16), same values as audioop.rms."""
+    if np is None:
+        step = frame_len * _VAD_SAMPLE_WIDTH
+        return [audioop.rms(raw[i:i + step], _VAD_SAMPLE_WIDTH) for i in range(0, len(raw), step)]
+    arr = np.frombuffer(raw, dtype=np.int16)
+    n = len(arr) // frame_len
+    if n == 0:
+        return []
+    sq = arr[:n * frame_len].astype(np.int64).reshape(n, frame_len)
+    return np.sqrt((sq * sq).mean(axis=1)).astype(np.int64).tolist()
+
+# One PortAudio instance + input stream for the whole session (opened lazily)
+_PA: Optional[pyaudio.PyAudio] = None
+_STREAM = None
+_STREAM_DEV: Optional[int] = None
+_STREAM_LOCK = threading.Lock()
+
+def _pick_input_device(pa: pyaudio.PyAudio) -> int:
     try:
-        # --- select input device ---
-        if device_index is None:
+        default_info = pa.get_default_input_device_info()
+        device_index = int(default_info.get("index", -1))
+    except Exception:
+        device_index = -1
+
+    if device_index < 0:
+        for i in range(pa.get_device_count()):
+            info = pa.get_device_info_by_index(i)
+            max_in = int(info.get("maxInputChannels", 0))
+            if max_in > 0:
+                device_index = i
+                break
+
+    if device_index < 0:
+        raise RuntimeError("No available audio input device found.")
+    return device_index
+
+def _get_input_stream(device_index: Optional[int] = None):
+    """Memoized (PyAudio, stream); reopened only if a different device is requested."""
+    global _PA, _STREAM, _STREAM_DEV
+    with _STREAM_LOCK:
+        if _STREAM is not None and (device_index is None or device_index == _STREAM_DEV):
+            return _STREAM
+        if _STREAM is not None:
             try:
-                default_info = pa.get_default_input_device_info()
-                device_index = int(default_info.get("index", -1))
+                _STREAM.close()
             except Exception:
-                device_index = -1
-
-            if device_index < 0:
-                for i in range(pa.get_device_count()):
-                    info = pa.get_device_info_by_index(i)
-                    max_in = int(info.get("maxInputChannels", 0))
-                    if max_in > 0:
-                        device_index = i
-                        break
-
-        if device_index is None or device_index < 0:
-            raise RuntimeError("No available audio input device found.")
-
-        # --- open the stream ---
-        stream = pa.open(
+                pass
+            _STREAM = None
+        if _PA is None:
+            _PA = pyaudio.PyAudio()
+        if device_index is None:
+            device_index = _pick_input_device(_PA)
+        _STREAM = _PA.open(
             format=pyaudio.paInt16,
             channels=_VAD_CHANNELS,
             rate=_VAD_SAMPLE_RATE,
             input=True,
             input_device_index=device_index,
-            frames_per_buffer=_frames_per_buffer(),
+            frames_per_buffer=_frames_per_buffer() * _VAD_BLOCK_FRAMES,
+            start=False,
         )
+        _STREAM_DEV = device_index
+        return _STREAM
 
-        try:
-            # --- calibration and preparation ---
-            THRESHOLD = _calibrate_threshold(stream, seconds=1.0, floor=300, mult=1.9)
-            voiced_needed  = _frames_count(_VAD_START_MS)
-            silence_needed = _frames_count(_VAD_END_MS)
-            preroll_len    = _frames_count(_VAD_PREROLL_MS)
-
-            recent   = collections.deque(maxlen=voiced_needed)
-            noise_ema: Optional[int] = None
-            preroll  = collections.deque(maxlen=preroll_len)
-
-            in_seg = False
-            buf = bytearray()
-            silence = 0
-            start_time: Optional[float] = None
-
-            # --- main reading loop ---
-            while True:
-                if stop_event and stop_event.is_set():
-                    break
+def _close_input_stream():
+    global _PA, _STREAM, _STREAM_DEV
+    with _STREAM_LOCK:
+        if _STREAM is not None:
+            try:
+                _STREAM.stop_stream()
+            except Exception:
+                pass
+            try:
+                _STREAM.close()
+            except Exception:
+                pass
+        if _PA is not None:
+            try:
+                _PA.terminate()
+            except Exception:
+                pass
+        _PA = _STREAM = _STREAM_DEV = None
+
+atexit.register(_close_input_stream)
+
+def _stream_segments(
+    stop_event: Optional[threading.Event] = None,
+    device_index: Optional[int] = None,
+):
+    """PCM speech segment generator (bytes) with auto start/stop on silence."""
+    stream = _get_input_stream(device_index)
+    # the stream stays open between phrases; it is only paused, so no stale audio (TTS tail) is buffered
+    if stream.is_stopped():
+        stream.start_stream()
+    try:
+        # --- preparation (threshold is bootstrapped from the first frames, no 1 s calibration) ---
+        THRESHOLD = 300
+        bootstrap = _VAD_BOOTSTRAP_FRAMES
+        voiced_needed  = _frames_count(_VAD_START_MS)
+        silence_needed = _frames_count(_VAD_END_MS)
+        preroll_len    = _frames_count(_VAD_PREROLL_MS)
+
+        recent   = collections.deque(maxlen=voiced_needed)
+        noise_ema: Optional[int] = None
+        preroll  = collections.deque(maxlen=preroll_len)
+
+        in_seg = False
+        chunks: List[bytes] = []           # joined once per segment (no bytearray regrowth)
+        silence = 0
+        seg_frames = 0                     # segment length in frames (instead of time.time())
+        max_seg_frames = _frames_count(_VAD_MAX_SEG_SEC * 1000)
+
+        frame_len   = _frames_per_buffer()
+        frame_bytes = frame_len * _VAD_SAMPLE_WIDTH
+        block_len   = frame_len * _VAD_BLOCK_FRAMES
+
+        # hot loop: pre-bound methods, integer (fixed-point) EMA, stop_event checked once per block
+        _read = stream.read
+        _append_pr = preroll.append
+        _append_rc = recent.append
+        _append_ch = chunks.append
+        _is_stopped = stop_event.is_set if stop_event else (lambda: False)
+
+        # --- main reading loop ---
+        while True:
+            if _is_stopped():
+                break
 
-                raw = stream.read(_frames_per_buffer(), exception_on_overflow=False)
-                preroll.append(raw)
+            block = _read(block_len, exception_on_overflow=False)
+            for k, rms in enumerate(_frames_rms(block, frame_len)):
+                raw = block[k * frame_bytes:(k + 1) * frame_bytes]
+                _append_pr(raw)
+                if bootstrap:
+                    # first ~150 ms: only learn the noise floor, never start a segment
+                    bootstrap -= 1
+                    noise_ema = rms if noise_ema is None else (7 * noise_ema + 3 * rms) // 10
+                    THRESHOLD = max(noise_ema * 19 // 10, 300)
+                    continue
 
-                rms = audioop.rms(raw, _VAD_SAMPLE_WIDTH)
                 is_speech = rms >= THRESHOLD
 
                 if not in_seg:
-                    noise_ema = rms if noise_ema is None else int(0.9 * noise_ema + 0.1 * rms)
-                    THRESHOLD = max(int((noise_ema or 1) * 1.7), 250)
-                    recent.append(is_speech)
+                    noise_ema = rms if noise_ema is None else (9 * noise_ema + rms) // 10
+                    THRESHOLD = max((noise_ema or 1) * 17 // 10, 250)
+                    _append_rc(is_speech)
 
-                    if len(recent) == recent.maxlen and sum(recent) >= (voiced_needed - 1):
+                    if len(recent) == voiced_needed and sum(recent) >= (voiced_needed - 1):
                         in_seg = True
-                        buf.clear()
+                        chunks.clear()
                         silence = 0
-                        start_time = time.time()
-                        for fr in preroll:
-                            buf += fr
+                        seg_frames = 0
+                        chunks.extend(preroll)
                         preroll.clear()
 
                 else:
-                    buf += raw
+                    _append_ch(raw)
+                    seg_frames += 1
                     silence = 0 if is_speech else (silence + 1)
 
-                    elapsed = (time.time() - start_time) if start_time else 0.0
-                    if silence >= silence_needed or (start_time and elapsed >= _VAD_MAX_SEG_SEC):
-                        yield bytes(buf)
+                    if silence >= silence_needed or seg_frames >= max_seg_frames:
+                        yield b"".join(chunks)
                         in_seg = False
-                        buf.clear()
+                        chunks.clear()
                         silence = 0
-                        start_time = None
-
-        finally:
-            # close stream even if it crashes in the loop
-            try:
-                stream.stop_stream()
-            except Exception:
-                pass
-            try:
-                stream.close()
-            except Exception:
-                pass
+                        seg_frames = 0
 
     finally:
-        # guaranteed to terminate PyAudio
+        # pause (not close) the shared stream even if the loop crashes
         try:
-            pa.terminate()
+            stream.stop_stream()
         except Exception:
             pass
 
@@ -342,21 +516,14 @@ def listen_vad_once(lang_code: str, log_fn, stop_event: threading.Event) -> str:
         pcm_seg = next(gen)  # blockingly waits for a phrase
     except StopIteration:
         return ""
-
-    # pack into WAV bytes and write to a temporary file (for transcribe_wav)
-    wav_bytes = _pcm16_to_wav_bytes(pcm_seg, sr=_VAD_SAMPLE_RATE)
-    tmp = tempfile.mkstemp(suffix=".wav")[1]
-    try:
-        with open(tmp, "wb") as f: f.write(wav_bytes)
-        # listen ONLY to the selected language
-        langs = (lang_code,)
-        text = transcribe_wav(tmp, langs=langs)
-        if text:
-            log_fn(f"Heard: {text}")
-        return (text or "").strip()
     finally:
-        try: os.remove(tmp)
-        except OSError: pass
+        gen.close()  # pause the shared input stream until the next phrase
+
+    # PCM goes straight to the model (no WAV / temp file); listen ONLY to the selected language
+    text = transcribe_pcm16(pcm_seg, langs=(lang_code,))
+    if text:
+        log_fn(f"Heard: {text}")
+    return (text or "").strip()
 
 # ======================= LLM intents =======================
 INTENT_SYSTEM = """
@@ -405,34 +572,95 @@ INTENT_SYSTEM = """
 "посмотрим короткую рокировку" => {"intent":"what_if","lang":"ru","data":{"moves_san":"O-O"}}
 """
 
-def understand_with_llm(text: str, prefer_lang: str) -> dict:
+# Частые короткие команды — без обращения к LLM
+_FAST_INTENTS: Dict[str, str] = {
+    "да": "confirm", "поехали": "confirm", "начинай": "confirm", "готов": "confirm",
+    "я готов": "confirm", "давай начнем": "confirm", "давай начинаем": "confirm",
+    "дальше": "continue", "продолжай": "continue", "идем дальше": "continue",
+    "в начало": "start", "в конец": "end",
+    "повтори": "repeat", "выход": "exit",
+}
+# Намерения без данных: их можно принять, как только LLM выдала "intent":"…"
+_RE_BARE_INTENT = re.compile(r'"intent"\s*:\s*"(confirm|continue|repeat|exit|start|end)"')
+_RE_PHRASE_TAIL = re.compile(r"[\s.,!?…«»\"']+$")
+
+def _stream_intent_json(prompt: str, prefer_lang: str) -> dict:
+    """Читаем ответ LLM потоком и обрываем генерацию, как только JSON-объект закрыт."""
+    out: List[str] = []
+    depth = 0
+    started = in_str = esc = False
+    done = False
+    for tok in ask_stream(prompt):
+        for ch in tok:
+            out.append(ch)
+            if in_str:
+                if esc:
+                    esc = False
+                elif ch == "\\":
+                    esc = True
+                elif ch == '"':
+                    in_str = False
+                continue
+            if ch == '"' and started:
+                in_str = True
+            elif ch == "{":
+                depth += 1
+                started = True
+            elif ch == "}" and started:
+                depth -= 1
+                if depth == 0:
+                    done = True
+                    break
+        if done:
+            break
+        if not in_str:
+            m = _RE_BARE_INTENT.search("".join(out))
+            if m:
+                return {"intent": m.group(1), "lang": prefer_lang, "data": {}}
+    resp = "".join(out).strip().strip("`")
+    start = resp.find("{")
+    end = resp.rfind("}")
+    return json.loads(resp[start:end+1])
+
+def _intent_phrase(text: str) -> str:
+    """Ключ фразы: нижний регистр, схлопнутые пробелы, без хвостовой пунктуации."""
+    t = " ".join((text or "").lower().split())
+    return _RE_PHRASE_TAIL.sub("", t)
+
+@functools.lru_cache(maxsize=512)
+def _understand_cached(phrase: str, prefer_lang: str) -> str:
     prompt = (
         f"{INTENT_SYSTEM}\n\n"
-        f"Фраза: «{text}»\n"
+        f"Фраза: «{phrase}»\n"
         f"Предпочтительный язык интерфейса: {prefer_lang}\n"
         f"Верни только JSON."
     )
+    obj = _stream_intent_json(prompt, prefer_lang)
+    # страховка по полям
+    if "intent" not in obj:
+        obj["intent"] = "unknown"
+    if "lang" not in obj:
+        obj["lang"] = prefer_lang
+    if "data" not in obj:
+        obj["data"] = {"raw": phrase}
+    # в кэше — неизменяемая строка, каждому вызывающему отдаём свежий dict
+    return json.dumps(obj, ensure_ascii=False)
+
+def understand_with_llm(text: str, prefer_lang: str) -> dict:
+    phrase = _intent_phrase(text)
+    fast = _FAST_INTENTS.get(phrase.replace("ё", "е"))
+    if fast:
+        return {"intent": fast, "lang": prefer_lang, "data": {}}
     try:
-        import json
-        resp = ask(prompt)
-        resp = resp.strip().strip("`")
-        start = resp.find("{")
-        end = resp.rfind("}")
-        obj = json.loads(resp[start:end+1])
-        # страховка по полям
-        if "intent" not in obj:
-            obj["intent"] = "unknown"
-        if "lang" not in obj:
-            obj["lang"] = prefer_lang
-        if "data" not in obj:
-            obj["data"] = {"raw": text}
-        return obj
+        # ошибки (LLM недоступна, битый JSON) не кэшируются — lru_cache не запоминает исключения
+        return json.loads(_understand_cached(phrase, prefer_lang))
     except Exception:
         return {"intent": "unknown", "lang": prefer_lang, "data": {"raw": text}}
 
-def uci_list_to_san_line(board: chess.Board, moves_uci: list[str]) -> str:
-    """Convert list of UCI strings to a SAN string from given board."""
-    b = board.copy()
+@functools.lru_cache(maxsize=256)
+def _uci_to_san_cached(fen: str, chess960: bool, moves_uci: tuple[str, ...]) -> str:
+    # SAN зависит только от позиции, история ходов не нужна
+    b = chess.Board(fen, chess960=chess960)
     out = []
     for u in moves_uci:
         mv = chess.Move.from_uci(u)
@@ -440,13 +668,17 @@ def uci_list_to_san_line(board: chess.Board, moves_uci: list[str]) -> str:
         b.push(mv)
     return " ".join(out)
 
+def uci_list_to_san_line(board: chess.Board, moves_uci: list[str]) -> str:
+    """Convert list of UCI strings to a SAN string from given board."""
+    return _uci_to_san_cached(board.fen(), board.chess960, tuple(moves_uci))
+
 
 # ======================= TTS MANAGER =======================
 class TTSManager:
     """Dedicated voiceover stream. Backends:
     - 'edge' → Microsoft Edge Neural (online), male voices: ru-Dmitry, en-Guy, no-Finn;
     - 'sapi' → Windows System.Speech (offline via PowerShell), auto-selection by culture.
-    Each line is spoken synchronously until the end.
+    Phrases are played one after another; while one plays, the next queued phrase is already synthesized.
     """
     def __init__(self, log_fn, backend: str = "edge"):
         self._log = log_fn
@@ -455,6 +687,16 @@ class TTSManager:
         self._thread = threading.Thread(target=self._run, daemon=True)
         self._stop = threading.Event()
         self._sapi_voice_map = {"ru": None, "en": None, "no": None}
+        self._sapi = None            # SAPI.SpVoice (pywin32), lives on the worker thread
+        self._voice_tokens: Dict[str, Any] = {}
+        self._ps: Optional[subprocess.Popen] = None   # long-lived PowerShell (no pywin32)
+        self._ps_lock = threading.Lock()
+        self._speaking = False
+        self._last_spoke_end = 0.0   # time.monotonic() when the last phrase finished
+        self._aio_loop = None        # one asyncio loop for all Edge requests (own thread)
+        self._voices_ready = threading.Event()
+        self._stream_ok = False      # miniaudio present → play Edge audio while it downloads
+        self._prefetched = None      # (text, lang, synth) already being synthesized for the next phrase
 
     def start(self):
         if not self._thread.is_alive():
@@ -465,90 +707,213 @@ class TTSManager:
         self._q.put(("", "en", threading.Event()))
 
     def speak_sync(self, text: str, lang: str):
+        self.speak_async(text, lang).wait()
+
+    def speak_async(self, text: str, lang: str) -> threading.Event:
+        """Queue a phrase without waiting; a phrase queued right after it is spoken in the same synthesis."""
         done = threading.Event()
         self._q.put((text, lang, done))
-        done.wait()
+        return done
+
+    def spoke_since(self, t: float) -> bool:
+        """True if TTS was playing at any moment after monotonic time t (echo guard for the mic)."""
+        return self._speaking or self._last_spoke_end >= t
 
     # ---------- generall ----------
+    # SAPI language ids (primary LANGID) → our language codes
+    _SAPI_LANGS = {0x19: "ru", 0x09: "en", 0x14: "no"}
+
+    def _init_sapi_com(self) -> bool:
+        """Create one in-process SAPI voice for the whole session (needs pywin32)."""
+        try:
+            import pythoncom
+            import win32com.client
+            pythoncom.CoInitialize()
+            self._sapi = win32com.client.Dispatch("SAPI.SpVoice")
+            return True
+        except Exception:
+            self._sapi = None
+            return False
+
+    def _detect_sapi_voices_com(self):
+        tokens: Dict[str, Any] = {}
+        names: Dict[str, Optional[str]] = {"ru": None, "en": None, "no": None}
+        first = None
+        voices = self._sapi.GetVoices()
+        for i in range(voices.Count):
+            tok = voices.Item(i)
+            if first is None:
+                first = tok
+            try:
+                lang_attr = tok.GetAttribute("Language") or ""
+                langid = int(lang_attr.split(";")[0], 16)
+            except Exception:
+                continue
+            code = self._SAPI_LANGS.get(langid & 0x3FF)
+            if code and code not in tokens:
+                tokens[code] = tok
+                try:
+                    names[code] = tok.GetAttribute("Name")
+                except Exception:
+                    names[code] = tok.GetDescription()
+        en = tokens.get("en") or first
+        for code in ("ru", "en", "no"):
+            if code not in tokens and en is not None:
+                tokens[code] = en
+                names[code] = names.get("en")
+        self._voice_tokens = tokens
+        self._sapi_voice_map = names
+
+    def _detect_sapi_voices_async(self):
+        """
+        Voice map without delaying the first phrase. COM enumeration is instant and must stay on
+        the worker thread (STA object); the PowerShell enumeration runs in the background and only
+        _sapi_speak waits for it — the Edge path never does.
+        """
+        if self._sapi is not None:
+            self._detect_sapi_voices()
+            return
+        threading.Thread(target=self._detect_sapi_voices, daemon=True).start()
+
     def _detect_sapi_voices(self):
-        ps_enum = r"""
-Add-Type -AssemblyName System.Speech
-$s = New-Object System.Speech.Synthesis.SpeechSynthesizer
-$s.GetInstalledVoices() | ForEach-Object {
-  $vi = $_.VoiceInfo
-  Write-Output ("{0}|{1}" -f $vi.Name, $vi.Culture)
-}
-"""
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".ps1", mode="w", encoding="utf-8") as f:
-            f.write(ps_enum)
-            path = f.name
         try:
-            res = subprocess.run(
-                ["powershell","-NoProfile","-ExecutionPolicy","Bypass","-File",path],
-                capture_output=True, text=True
-            )
-            out = (res.stdout or "").strip()
-            ru=en=nb=None
-            for line in out.splitlines():
-                parts = line.split("|", 1)
-                if len(parts) != 2: continue
-                name, culture = parts[0].strip(), parts[1].strip().lower()
-                if not ru and culture.startswith("ru"): ru = name
-                if not en and culture.startswith("en"): en = name
-                if not nb and (culture.startswith("nb") or culture.startswith("no")): nb = name
-            if not en: en = "Microsoft Zira Desktop - English (United States)"
-            if not ru: ru = en
-            if not nb: nb = en
-            self._sapi_voice_map = {"ru": ru, "en": en, "no": nb}
+            self._detect_sapi_voices_inner()
         finally:
-            try: os.remove(path)
-            except OSError: pass
+            self._voices_ready.set()
+
+    def _detect_sapi_voices_inner(self):
+        if self._sapi is not None:
+            try:
+                self._detect_sapi_voices_com()
+                return
+            except Exception:
+                pass
+        try:
+            out = self._ps_exec(
+                "$s.GetInstalledVoices() | ForEach-Object { "
+                "$vi = $_.VoiceInfo; Write-Output ('{0}|{1}' -f $vi.Name, $vi.Culture) }"
+            )
+        except RuntimeError:
+            out = ""
+        ru=en=nb=None
+        for line in out.splitlines():
+            parts = line.split("|", 1)
+            if len(parts) != 2: continue
+            name, culture = parts[0].strip(), parts[1].strip().lower()
+            if not ru and culture.startswith("ru"): ru = name
+            if not en and culture.startswith("en"): en = name
+            if not nb and (culture.startswith("nb") or culture.startswith("no")): nb = name
+        if not en: en = "Microsoft Zira Desktop - English (United States)"
+        if not ru: ru = en
+        if not nb: nb = en
+        self._sapi_voice_map = {"ru": ru, "en": en, "no": nb}
+
+    # ---------- persistent PowerShell host (fallback without pywin32) ----------
+    _PS_DONE = "##DONE##"
+    _PS_PRELUDE = (
+        "Add-Type -AssemblyName System.Speech; Add-Type -AssemblyName PresentationCore; "
+        "$s = New-Object System.Speech.Synthesis.SpeechSynthesizer; "
+        # MP3 player defined once per host; each call only passes the path as an argument
+        "function Play-Mp3([string]$path) { "
+        "$player = New-Object System.Windows.Media.MediaPlayer; "
+        "$player.Open((New-Object System.Uri($path))); "
+        "$player.Volume = 1.0; $player.Play(); "
+        "while (-not $player.NaturalDuration.HasTimeSpan) { Start-Sleep -Milliseconds 100 }; "
+        "while ($player.Position -lt $player.NaturalDuration.TimeSpan) { Start-Sleep -Milliseconds 100 }; "
+        "$player.Close() }"
+    )
+
+    @staticmethod
+    def _ps_str(text: str) -> str:
+        """PowerShell expression for an arbitrary UTF-8 string (safe for stdin code pages)."""
+        import base64
+        b64 = base64.b64encode(text.encode("utf-8")).decode("ascii")
+        return f"[Text.Encoding]::UTF8.GetString([Convert]::FromBase64String('{b64}'))"
+
+    def _ps_exec(self, command: str) -> str:
+        """Run one single-line command in the long-lived PowerShell; returns its stdout."""
+        with self._ps_lock:
+            if self._ps is None or self._ps.poll() is not None:
+                try:
+                    self._ps = subprocess.Popen(
+                        ["powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", "-NoExit", "-Command", "-"],
+                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                        text=True, encoding="utf-8", errors="replace", bufsize=1,
+                    )
+                except FileNotFoundError as e:
+                    raise RuntimeError("PowerShell не найден в PATH. Установите/проверьте доступность `powershell`.") from e
+                self._ps.stdin.write(self._PS_PRELUDE + "\n")
+            ps = self._ps
+            try:
+                ps.stdin.write(f"{command}; Write-Output '{self._PS_DONE}'\n")
+                ps.stdin.flush()
+                lines: List[str] = []
+                while True:
+                    line = ps.stdout.readline()
+                    if not line:
+                        raise RuntimeError("TTS: процесс PowerShell неожиданно завершился.")
+                    line = line.rstrip("\r\n")
+                    if line == self._PS_DONE:
+                        return "\n".join(lines)
+                    lines.append(line)
+            except (OSError, RuntimeError):
+                self._ps = None
+                try: ps.kill()
+                except Exception: pass
+                raise
+
+    def _ps_close(self):
+        ps, self._ps = self._ps, None
+        if ps is None:
+            return
+        try:
+            ps.stdin.write("exit\n"); ps.stdin.flush()
+            ps.wait(timeout=2)
+        except Exception:
+            try: ps.kill()
+            except Exception: pass
 
     # ---------- SAPI (offline) ----------
     def _sapi_speak(self, text: str, lang: str):
+        self._voices_ready.wait()
         voice_name = self._sapi_voice_map.get(lang) or self._sapi_voice_map.get("en")
         if lang == "ru":
             text = (text.replace("±"," плюс-минус ").replace("−"," минус ")
                         .replace("+"," плюс ").replace("-"," минус "))
-        ps = r"""
-param([string]$voice,[string]$text)
-Add-Type -AssemblyName System.Speech
-$s = New-Object System.Speech.Synthesis.SpeechSynthesizer
-try { $s.SelectVoice($voice) } catch {}
-$s.Rate = 0; $s.Volume = 100
-$s.Speak($text)
-"""
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".ps1", mode="w", encoding="utf-8") as f:
-            f.write(ps)
-            path = f.name
-
-        try:
-            args: List[str] = [
-                "powershell",
-                "-NoProfile",
-                "-ExecutionPolicy", "Bypass",
-                "-File", path,
-                str(voice_name),
-                str(text),
-            ]
-            completed = subprocess.run(
-                args,
-                check=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-        except FileNotFoundError as e:
-            raise RuntimeError("PowerShell не найден в PATH. Установите/проверьте доступность `powershell`.") from e
-        except subprocess.CalledProcessError as e:
-            err = e.stderr.decode("utf-8", "ignore") if e.stderr else str(e)
-            raise RuntimeError(f"TTS-скрипт PowerShell завершился с ошибкой:\n{err}") from e
-        finally:
-            try:
-                os.unlink(path)
-            except Exception:
-                pass
+        if self._sapi is not None:
+            tok = self._voice_tokens.get(lang) or self._voice_tokens.get("en")
+            if tok is not None:
+                self._sapi.Voice = tok
+            self._sapi.Rate = 0
+            self._sapi.Volume = 100
+            self._sapi.Speak(text, 0)  # 0 = SVSFDefault (synchronous)
+            return
+        # Fallback without pywin32: the same long-lived PowerShell for every phrase
+        flat = " ".join(str(text).split())
+        self._ps_exec(
+            f"try {{ $s.SelectVoice({self._ps_str(str(voice_name))}) }} catch {{}}; "
+            f"$s.Rate = 0; $s.Volume = 100; $s.Speak({self._ps_str(flat)})"
+        )
 
     # ---------- Edge Neural (online) ----------
+    def _aio_submit(self, coro) -> "concurrent.futures.Future":
+        """Schedule a coroutine on the session-wide event loop without waiting."""
+        import asyncio
+        if self._aio_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, daemon=True).start()
+            self._aio_loop = loop
+        return asyncio.run_coroutine_threadsafe(coro, self._aio_loop)
+
+    def _aio_run(self, coro):
+        """Run a coroutine on the session-wide event loop and wait for its result."""
+        return self._aio_submit(coro).result()
+
+    def _aio_close(self):
+        loop, self._aio_loop = self._aio_loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+
     async def _edge_to_file(self, text: str, voice: str, path: str):
         import edge_tts
         tts = edge_tts.Communicate(text=text, voice=voice)
@@ -561,64 +926,256 @@ $s.Speak($text)
                         f.write(data)
 
 
+    async def _edge_pump(self, text: str, voice: str, out: "queue.Queue[Optional[bytes]]"):
+        import edge_tts
+        try:
+            tts = edge_tts.Communicate(text=text, voice=voice)
+            async for chunk in tts.stream():
+                if isinstance(chunk, dict) and chunk.get("type") == "audio":
+                    data = chunk.get("data")
+                    if isinstance(data, (bytes, bytearray)):
+                        out.put(bytes(data))
+        finally:
+            out.put(None)  # EOF
+
+    def _edge_stream_play(self, mp3_q: "queue.Queue[Optional[bytes]]", synth_fut: "concurrent.futures.Future"):
+        """Pipeline: Edge synth (already running) → MP3 decode → playback, all overlapping (miniaudio)."""
+        import miniaudio
+
+        fmt = miniaudio.SampleFormat.SIGNED16
+        nch, rate = 1, 24000  # Edge default output: 24 kHz mono MP3
+        errors: List[BaseException] = []
+
+        class _QueueSource(miniaudio.StreamableSource):
+            def __init__(self):
+                self._buf = bytearray()
+                self._eof = False
+
+            def read(self, num_bytes: int) -> bytes:
+                while len(self._buf) < num_bytes and not self._eof:
+                    part = mp3_q.get()
+                    if part is None:
+                        self._eof = True
+                    else:
+                        self._buf += part
+                out = bytes(self._buf[:num_bytes])
+                del self._buf[:num_bytes]
+                return out
+
+        pcm: "collections.deque[array.array]" = collections.deque()
+        decoded = threading.Event()
+        finished = threading.Event()
+        played = threading.Event()
+
+        def decode():
+            try:
+                stream = miniaudio.stream_any(_QueueSource(), source_format=miniaudio.FileFormat.MP3,
+                                              output_format=fmt, nchannels=nch, sample_rate=rate)
+                for block in stream:
+                    pcm.append(block)
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                decoded.set()
+
+        def feed():
+            required = yield b""  # primer
+            rest = array.array("h")
+            while True:
+                want = required * nch
+                while len(rest) < want and pcm:
+                    rest.extend(pcm.popleft())
+                if not rest and decoded.is_set() and not pcm:
+                    break
+                chunk = rest[:want]
+                del rest[:want]
+                if chunk:
+                    played.set()
+                if len(chunk) < want:  # network/decoder behind: pad with silence
+                    chunk.extend([0] * (want - len(chunk)))
+                required = yield chunk
+            finished.set()
+
+        decoder = threading.Thread(target=decode, daemon=True)
+        decoder.start()
+
+        dev = miniaudio.PlaybackDevice(output_format=fmt, nchannels=nch, sample_rate=rate)
+        try:
+            gen = feed()
+            next(gen)
+            dev.start(gen)
+            while not finished.wait(timeout=0.1):
+                if self._stop.is_set():
+                    break
+                self._maybe_prefetch()  # next phrase synthesizes while this one plays
+            time.sleep(0.2)  # let the device drain its last buffer
+        finally:
+            dev.close()
+        if not played.is_set():
+            if synth_fut.done() and not synth_fut.cancelled() and synth_fut.exception() is not None:
+                errors.insert(0, synth_fut.exception())
+            if errors:
+                raise errors[0]  # nothing was heard → caller falls back to SAPI
+
     def _edge_play_mp3_sync(self, mp3_path: str):
-        p = mp3_path.replace("'", "''")
-        ps = f"""
-    Add-Type -AssemblyName PresentationCore
-    $u = New-Object System.Uri('{p}')
-    $player = New-Object System.Windows.Media.MediaPlayer
-    $player.Open($u)
-    $player.Volume = 1.0
-    $player.Play()
-    while (-not $player.NaturalDuration.HasTimeSpan) {{ Start-Sleep -Milliseconds 100 }}
-    while ($player.Position -lt $player.NaturalDuration.TimeSpan) {{ Start-Sleep -Milliseconds 100 }}
-    $player.Close()
-    """
-        subprocess.run(["powershell","-NoProfile","-ExecutionPolicy","Bypass","-Command", ps], check=True)
+        self._ps_exec(f"Play-Mp3 ({self._ps_str(mp3_path)})")
+
+    _EDGE_VOICES = {
+        "ru": "ru-RU-DmitryNeural",
+        "en": "en-US-GuyNeural",
+        "no": "nb-NO-FinnNeural",
+    }
+
+    def _edge_synth_start(self, text: str, lang: str):
+        """Start Edge synthesis in the background → ('stream', mp3 queue, fut) or ('file', path, fut)."""
+        voice = self._EDGE_VOICES.get(lang, "en-US-GuyNeural")
+        if self._stream_ok:
+            mp3_q: "queue.Queue[Optional[bytes]]" = queue.Queue()
+            return ("stream", mp3_q, self._aio_submit(self._edge_pump(text, voice, mp3_q)))
+        fd, mp3 = tempfile.mkstemp(suffix=".mp3")
+        os.close(fd)
+        return ("file", mp3, self._aio_submit(self._edge_to_file(text, voice, mp3)))
+
+    @staticmethod
+    def _edge_synth_drop(synth):
+        kind, target, fut = synth
+        fut.cancel()
+        if kind == "file":
+            try: os.remove(target)
+            except OSError: pass
+
+    def _maybe_prefetch(self):
+        """If the next phrase is already queued, start its synthesis now (one phrase ahead)."""
+        if self._backend != "edge" or self._prefetched is not None:
+            return
+        nxt = self._peek_next()
+        if nxt is None:
+            return
+        text, lang = nxt
+        text = self._prepare(text, lang)
+        try:
+            self._prefetched = (text, lang, self._edge_synth_start(text, lang))
+        except Exception:
+            self._prefetched = None
+
+    def _take_prefetched(self, text: str, lang: str):
+        pre, self._prefetched = self._prefetched, None
+        if pre is None:
+            return None
+        p_text, p_lang, synth = pre
+        if p_text == text and p_lang == lang:
+            return synth
+        self._edge_synth_drop(synth)  # more phrases were merged in meanwhile → resynthesize
+        return None
 
     def _edge_speak(self, text: str, lang: str):
-        import asyncio, tempfile, os
-        voice = {
-            "ru": "ru-RU-DmitryNeural",
-            "en": "en-US-GuyNeural",
-            "no": "nb-NO-FinnNeural",
-        }.get(lang, "en-US-GuyNeural")
-
-        mp3 = tempfile.mkstemp(suffix=".mp3")[1]
+        synth = self._take_prefetched(text, lang) or self._edge_synth_start(text, lang)
+        kind, target, fut = synth
         try:
-            asyncio.run(self._edge_to_file(text, voice, mp3))
-            self._edge_play_mp3_sync(mp3)
+            if kind == "stream":
+                # No tempfile, no PowerShell: synth chunks are decoded and played as they arrive
+                self._edge_stream_play(target, fut)
+            else:
+                fut.result()
+                self._maybe_prefetch()
+                self._edge_play_mp3_sync(target)
         except Exception:
             self._sapi_speak(text, lang)
         finally:
-            try: os.remove(mp3)
-            except OSError: pass
+            if kind == "file":
+                try: os.remove(target)
+                except OSError: pass
 
     # ---------- work flow ----------
+    _COALESCE_WINDOW = 0.05   # sec to wait for a follow-up phrase
+
+    def _coalesce(self, first):
+        """
+        Merge phrases queued back-to-back (same language) into one text → one synth/play cycle.
+        Returns (text, lang, [done events]); a phrase in another language is put back to the front.
+        """
+        text, lang, done = first
+        texts, dones = [text] if text else [], [done]
+        deadline = time.monotonic() + self._COALESCE_WINDOW
+        while text:
+            try:
+                nxt = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            n_text, n_lang, n_done = nxt
+            if not n_text or n_lang != lang:
+                with self._q.mutex:          # keep order: the odd one goes first next time
+                    self._q.queue.appendleft(nxt)
+                    self._q.not_empty.notify()
+                break
+            texts.append(n_text)
+            dones.append(n_done)
+        return self._merge_texts(texts), lang, dones
+
+    @staticmethod
+    def _merge_texts(texts: List[str]) -> str:
+        merged = ""
+        for t in texts:
+            t = t.strip()
+            if not t:
+                continue
+            if merged:
+                merged += " " if merged[-1] in ".!?…" else ". "
+            merged += t
+        return merged
+
+    def _peek_next(self) -> Optional[Tuple[str, str]]:
+        """What _coalesce would produce from the queue right now, without taking anything."""
+        with self._q.mutex:
+            items = list(self._q.queue)
+        if not items or not items[0][0]:
+            return None
+        lang = items[0][1]
+        texts = []
+        for text, n_lang, _ in items:
+            if not text or n_lang != lang:
+                break
+            texts.append(text)
+        merged = self._merge_texts(texts)
+        return (merged, lang) if merged else None
+
+    @staticmethod
+    def _prepare(text: str, lang: str) -> str:
+        if lang == "ru":
+            text = (text.replace("±"," плюс-минус ").replace("−"," минус ")
+                        .replace("+"," плюс ").replace("-"," минус "))
+        return text
+
     def _run(self):
-        self._detect_sapi_voices()
+        self._init_sapi_com()
+        self._detect_sapi_voices_async()
         if self._backend == "edge":
             try:
                 import edge_tts  # noqa
             except Exception:
                 self._backend = "sapi"
+            try:
+                import miniaudio  # noqa
+                self._stream_ok = True
+            except Exception:
+                self._stream_ok = False
 
         while not self._stop.is_set():
             try:
-                text, lang, done = self._q.get(timeout=0.1)
+                item = self._q.get(timeout=0.1)
             except queue.Empty:
                 continue
+            text, lang, dones = self._coalesce(item)
             try:
                 if not text:
-                    done.set(); continue
-                if lang == "ru":
-                    text = (text.replace("±"," плюс-минус ").replace("−"," минус ")
-                                .replace("+"," плюс ").replace("-"," минус "))
+                    continue
+                text = self._prepare(text, lang)
                 # NEW: log spoken line
                 try:
                     self._log(f"Say: {text}")
                 except Exception:
                     pass
+                self._speaking = True
                 if self._backend == "edge":
                     self._edge_speak(text, lang)
                 else:
@@ -627,7 +1184,24 @@ $s.Speak($text)
                 pass
             finally:
                 time.sleep(0.1)
-                done.set()
+                if self._speaking:
+                    self._speaking = False
+                    self._last_spoke_end = time.monotonic()
+                for done in dones:
+                    done.set()
+
+        if self._prefetched is not None:
+            self._edge_synth_drop(self._prefetched[2])
+            self._prefetched = None
+        self._ps_close()
+        self._aio_close()
+        if self._sapi is not None:
+            self._sapi = None
+            try:
+                import pythoncom
+                pythoncom.CoUninitialize()
+            except Exception:
+                pass
 
 # ======================= Actions =======================
 def open_analysis_startpos():
@@ -658,485 +1232,615 @@ COMMANDS = {
     }
 }
 
-# ======================= Рабочий цикл =======================
-def run_assistant(lang_code: str, log_fn, stop_event: threading.Event, on_done, tts: TTSManager):
-    coach: CoachSession | None = None
-    last_reply: str = ""
-    awaiting_confirm_to_start = False 
-    awaiting_variant_choice = False   
-    last_branch_info: dict | None = None
-    awaiting_mistake_query = False      # ждём "как правильно?"
-    last_mistake_hint: dict | None = None  # {"played_san":..., "best_san":..., "cpl":..., "mark":...}
-    coach = None 
+# Оценка сыгранного хода по отметке движка
+_QUALITY_RU = {"": "нормальный", "?!": "неточный", "?": "ошибочный", "??": "зевок"}
 
+# ======================= Рабочий цикл =======================
+def _capture_loop(log_fn, stop_event: threading.Event, captured_q: "queue.Queue[bytes]", tts: TTSManager):
+    """Microphone → VAD segments, without pauses for ASR. Segments overlapping TTS playback are dropped."""
+    bytes_per_sec = _VAD_SAMPLE_RATE * _VAD_SAMPLE_WIDTH
     try:
-        init_asr(model_size="large-v3", device="cpu", compute_type="int8")
-        tts.speak_sync(COMMANDS[lang_code]["hello"], lang_code)
+        for pcm in _stream_segments(stop_event=stop_event, device_index=None):
+            seg_start = time.monotonic() - len(pcm) / bytes_per_sec
+            if tts.spoke_since(seg_start):
+                continue  # it is (at least partly) our own voice
+            captured_q.put(pcm)
+    except Exception as e:
+        log_fn(f"Microphone error: {e}")
 
-        coach: Optional[CoachSession] = None      
-        last_reply: str = ""                   
+def _asr_loop(lang_code: str, log_fn, stop_event: threading.Event,
+              captured_q: "queue.Queue[bytes]", asr_q: "queue.Queue[str]"):
+    """VAD segments → text (strictly in the selected language)."""
+    while not stop_event.is_set():
+        try:
+            pcm = captured_q.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        try:
+            text = (transcribe_pcm16(pcm, langs=(lang_code,)) or "").strip()
+        except Exception as e:
+            log_fn(f"ASR error: {e}")
+            continue
+        if text:
+            log_fn(f"Heard: {text}")
+            asr_q.put(text)
 
-        while not stop_event.is_set():
-            raw = listen_vad_once(lang_code, log_fn, stop_event)
-            text = raw.strip()
-            if not text:
-                continue
+def _announce_engine_line(best_san: str, pv_spoken: str, played_now: str, tts: TTSManager, lang: str):
+    if not best_san or (played_now and played_now == best_san):
+        return
+    msg = pv_spoken or san_to_speech(best_san)
+    tts.speak_sync(f"Первая линия движка: {msg}.", lang)
 
-            intent = understand_with_llm(text, lang_code)
-            it = intent.get("intent", "unknown")
+# ---------- engine results cached by position (see eval_cache) ----------
+def _engine_branch(coach: CoachSession, board: chess.Board, move: Optional[chess.Move], depth: int,
+                   cancel: Optional[threading.Event] = None) -> dict:
+    # the mistake verdict depends on the played move and on the opening filter (fullmove <= 6), not only on the position
+    # an aborted run raises SearchAborted, so nothing partial is cached
+    key = eval_cache.make_key("branch", board, move.uci() if move else "", int(board.fullmove_number <= 6), depth)
+    return eval_cache.cached(key, lambda: coach.analyze_branch(board, move, depth=depth, cancel=cancel))
 
-            if it == "exit":
-                tts.speak_sync(COMMANDS[lang_code]["bye"], lang_code)
-                break
+# background engine work for a branch point (CoachSession serializes its own engine via a lock)
+_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=3, thread_name_prefix="engine")
 
-            elif it == "start_opponent":
-                data = intent.get("data", {}) or {}
-                opp = (data.get("opponent") or "").strip()
-                if not opp:
-                    tts.speak_sync("Не расслышал имя соперника.", lang_code)
-                    continue
-                if coach:
-                    coach.close()
-                coach = CoachSession(str(ENGINE_PATH))
-                pgn_path = CoachSession.find_pgn_by_opponent(ANALYSIS_DIRS, opp)
-                if not pgn_path:
-                    existing = [str(p) for p in ANALYSIS_DIRS if p.exists()]
-                    log_fn(f"[search] Not found. Searched in: {', '.join(existing)}")
-                    tts.speak_sync("Не нашел такую партию.", lang_code)
-                    continue
-                coach.load_pgn(pgn_path)
-                awaiting_confirm_to_start = True
-                awaiting_variant_choice = False
-                last_branch_info = None
-                tts.speak_sync(COMMANDS[lang_code]["opened"], lang_code)  # «Открыто. Готов начать просмотр?»
-
-            elif it == "start_latest":
-                if re.search(r"\bпротив\b", text, re.IGNORECASE):
-                    tts.speak_sync("Не расслышал имя соперника.", lang_code)
-                    continue
-                data = intent.get("data", {}) or {}
-                today_only = bool(data.get("today", True))
-                if coach:
-                    coach.close()
-                coach = CoachSession(str(ENGINE_PATH))
-                pgn_path = CoachSession.find_latest_pgn(ANALYSIS_DIRS, today_only=today_only)
-                if not pgn_path:
-                    existing = [str(p) for p in ANALYSIS_DIRS if p.exists()]
-                    log_fn(f"[latest] Not found. Searched in: {', '.join(existing)}")
-                    tts.speak_sync("Партия не найдена.", lang_code)
-                    continue
-                coach.load_pgn(pgn_path)
-                awaiting_confirm_to_start = True
-                awaiting_variant_choice = False
-                last_branch_info = None
-                tts.speak_sync(COMMANDS[lang_code]["opened"], lang_code)
-
-            elif it == "goto_by_san":
-                if not (coach and coach.state.game):
-                    tts.speak_sync("Партия не открыта.", lang_code); continue
-
-                data = intent.get("data", {}) or {}
-                phrase = text or ""
-
-                # --- эвристика: фразы типа «посмотрим/вариант/посмотри/покажи» => это анализ (what_if)
-                wants_analysis = bool(re.search(r"\b(вариант|посмотр(им|и)|посмотри|покажи)\b", phrase, re.IGNORECASE))
-
-                # распознаём рокировку в естественной форме
-                castling_san = None
-                if re.search(r"коротк\w*\s+рокиров", phrase, re.IGNORECASE):
-                    castling_san = "O-O"
-                elif re.search(r"длинн\w*\s+рокиров", phrase, re.IGNORECASE):
-                    castling_san = "O-O-O"
-
-                if wants_analysis or castling_san:
-                    # → Перенаправляем в «анализ варианта»
-                    san = extract_variant_san(phrase, data, coach.state.board)
-                    if not san:
-                        tts.speak_sync("Не распознала вариант. Повторите, пожалуйста.", lang_code); continue
-
-                    res = coach.what_if_san(san, depth=23, multipv=2, show_progress=True)
-                    if "error" in res:
-                        tts.speak_sync("Ошибка в варианте: " + res["error"], lang_code); continue
-                    lines = res.get("lines", [])
-                    if not lines:
-                        tts.speak_sync("Нет варианта от движка.", lang_code); continue
-
-                    def fmt_cp(cp: int) -> str:
-                        return "мат" if abs(cp) >= 9000 else f"{cp/100.0:+.2f}"
-
-                    tts.speak_sync(f"Проверила: {san_to_speech(san)}. {fmt_cp(lines[0]['cp'])}.", lang_code)
-                    try:
-                        pv0 = (lines[0].get("pv_san") or "")
-                        pv_clean = strip_move_numbers(pv0)
-                        pv_tokens = [t for t in pv_clean.split() if t]
-                        pv_spoken = pv_to_speech(pv_tokens[:6])  # до 3 полных ходов
-                        if pv_spoken:
-                            tts.speak_sync(pv_spoken, lang_code)
-                    except Exception:
-                        pass
-                    # Ждём «продолжай» или новый запрос
-                    continue
+# short PV: a quick shallow answer first, the deep one refines it in the background
+_PV_DEPTHS = (10, 16)
 
-                # --- обычный сценарий «перейти к моменту SAN» (goto) ---
-                san = (data.get("san") or "").strip()
-                if not san:
-                    san = (maybe_extract_san(phrase) or "").strip()
-                if not san:
-                    tts.speak_sync("Не расслышал ход.", lang_code); continue
+def _engine_best_progressive(board: chess.Board, cancel: Optional[threading.Event] = None):
+    """
+    Returns (first, final) futures: `first` resolves at the shallowest depth, `final` at the
+    deepest (that one is cached). On a cache hit both are already resolved.
+    """
+    key = eval_cache.make_key("best", board, _PV_DEPTHS[-1])
+    hit = eval_cache.get(key)
+    if hit is not None:
+        done = concurrent.futures.Future()
+        done.set_result(hit)
+        return done, done
 
-                st = coach.goto_by_san(san)
-                if "error" in st:
-                    tts.speak_sync("Не нашел такой ход в мейнлайне.", lang_code)
-                else:
-                    tts.speak_sync("Готово.", lang_code)
-
-            elif it == "confirm":
-                if awaiting_confirm_to_start and coach and coach.state.game:
-                    info = coach.autoplay_to_first_branch(min_fullmove=4, max_fullmove=6)
-                    if "error" in info:
-                        tts.speak_sync("Не удалось начать просмотр.", lang_code)
-                        continue
-                    awaiting_confirm_to_start = False
-                    last_branch_info = info
-
-                    # Say opening name only once per session
-                    name = coach.opening_name_once()
-                    if name:
-                        # Собираем аккуратную русскую фразу про дебют
-                        try:
-                            # Попробуем вытащить пару первых «книжных» ходов для красивой концовки
-                            book = coach.opening_info_current(top_n=3)
-                            top = [m["san"] for m in (book.get("top") or [])]
-                            phrase = opening_title_to_speech(title_ru=name, moves_line=top[:3])
-                            tts.speak_sync(phrase, lang_code)
-                        except Exception:
-                            tts.speak_sync(f"Это {name}.", lang_code)
-                    # Озвучим первые ходы партии до развилки
-                    path = info.get("path_san") or []
-                    if path:
-                        tts.speak_sync("Начало партии: " + pv_to_speech(path), lang_code)
-                    
-                    mist = coach.detect_mistake_on_next_main_move(depth=18)
-                    played = (mist.get("played_san") or "")
-                    best_for_mist = (mist.get("best_san") or "")
-                    mark = (mist.get("mark") or "")
-                    quality = {"": "нормальный", "?!": "неточный", "?": "ошибочный", "??": "зевок"}.get(mark, "нормальный")
-
-                    # Who is to move now?
-                    is_user_to_move = (coach.state.user_side is not None and coach.state.user_side == coach.state.board.turn)
-                    who = "Ты" if is_user_to_move else "Соперник"
-
-                    if played:
-                        if best_for_mist and best_for_mist == played:
-                            # user's (or opponent's) move equals engine's first line
-                            tts.speak_sync(f"В этой позиции {who.lower()} сыграл: {san_to_speech(played)}. Это первая линия.", lang_code)
-                        else:
-                            tts.speak_sync(f"В этой позиции {who.lower()} сыграл: {san_to_speech(played)}. Это {quality} ход.", lang_code)
-
-
-                    # 3) Engine: best line + equal-strength alternatives (never duplicate the best)
-                    opts = coach.first_line_and_equal_alts(depth=16, multipv=3)
-                    best_san = opts.get("best_san") or ""
-                    equal_alts_raw = opts.get("equal_alts") or []
-
-                    played = (mist.get("played_san") or "")
-                    equal_alts = [a for a in equal_alts_raw if a and a != best_san and a != played]
-                    # Keep these engine alternatives for the 'choose' intent
-                    if isinstance(last_branch_info, dict):
-                        last_branch_info["engine_alts"] = equal_alts
-
-                    # Short PV for the best line (≈2 full moves)
-                    pv_spoken = ""
-                    try:
-                        fen_now = coach.state.board.fen()
-                        best_info = analyze_fen(fen_now, depth=16) or {}
-                        pv = best_info.get("pv") or []
-                        # всегда приводим к списку SAN-токенов
-                        if isinstance(pv, str):
-                            pv = [t for t in strip_move_numbers(pv).split() if t]
-                        if isinstance(pv, list):
-                            pv = [t.strip() for t in pv if t.strip()]
-                        pv_spoken = pv_to_speech(pv[:4]) if pv else ""
-                    except Exception:
-                        pv_spoken = ""
-
-                    # Skip speaking engine's first line if it matches the played move
-                    played_now = (mist.get("played_san") or "")
-                    if played_now and best_san and played_now == best_san:
-                        # Do not speak the first line block at all
-                        pass
-                    else:
-                        if best_san:
-                            if pv_spoken:
-                                tts.speak_sync(f"Первая линия движка: {pv_spoken}.", lang_code)
-                            else:
-                                tts.speak_sync(f"Первая линия движка: {san_to_speech(best_san)}.", lang_code)
-
-                    if best_san:
-                        if pv_spoken:
-                            tts.speak_sync(f"Первая линия движка: {pv_spoken}.", lang_code)
-                        else:
-                            tts.speak_sync(f"Первая линия движка: {san_to_speech(best_san)}.", lang_code)
-
-                    if equal_alts:
-                        alts_spoken = [san_to_speech(x) for x in equal_alts[:2]]
-                        phr = "Альтернативы: " + ", ".join(alts_spoken)
-                        tts.speak_sync(phr + ".", lang_code)
-                        awaiting_variant_choice = True
-                    else:
-                        awaiting_variant_choice = False
-                else:
-                    it = "continue"
-
-            elif it == "choose":
-                if not (coach and coach.state.game and last_branch_info and awaiting_variant_choice):
-                    tts.speak_sync("Сейчас не жду выбора варианта.", lang_code); continue
-                idx = int((intent.get("data", {}) or {}).get("index") or 1)
-                alt_list = (last_branch_info.get("engine_alts") if last_branch_info else None) or \
-                            (last_branch_info.get("alt_first", []) if last_branch_info else []) or []
-                if not (1 <= idx <= len(alt_list)):
-                    tts.speak_sync("Такого варианта нет.", lang_code); continue
-                first_move = alt_list[idx-1]
-                # Глубокий анализ выбранной альтернативы (d=23) с прогрессом в консоли
-                res = coach.what_if_san(first_move, depth=23, multipv=2, show_progress=True)
-                if "error" in res:
-                    tts.speak_sync("Ошибка в варианте.", lang_code); continue
-                lines = res.get("lines", [])
-                if not lines:
-                    tts.speak_sync("Нет варианта от движка.", lang_code); continue
-                def fmt_cp(cp: int) -> str:
-                    return "мат" if abs(cp) >= 9000 else f"{cp/100.0:+.2f}"
-                summary = " ; ".join([f"{i['idx']}) {fmt_cp(i['cp'])}" for i in lines[:2]])
-                tts.speak_sync(f"Проверила: {first_move}. {summary}. Продолжать?", lang_code)
-                # Озвучим первый вариант движка (2–3 полных хода)
-                try:
-                    pv0 = (lines[0].get("pv_san") if lines else "") or ""
-                    pv_clean = strip_move_numbers(pv0)
-                    pv_tokens = [t for t in pv_clean.split() if t]
-                    pv_spoken = pv_to_speech(pv_tokens[:6])
-                    if pv_spoken:
-                        tts.speak_sync(pv_spoken, lang_code)
-                except Exception:
-                    pass
+    first: concurrent.futures.Future = concurrent.futures.Future()
 
-                awaiting_variant_choice = False  # дальше слушаем «продолжай» или новые запросы
+    def publish(res: dict):
+        if not first.done():
+            first.set_result(res)
 
-            elif it == "continue":
-                if not (coach and coach.state.game):
-                    tts.speak_sync("Партия не открыта.", lang_code); continue
-                # шаг по мейнлайну до следующей развилки (или просто +1/-? — выберем до следующей развилки)
-                info = coach.autoplay_to_first_branch(
-                    min_fullmove=coach.state.board.fullmove_number+1,
-                    max_fullmove=999
-                )
-                if "error" in info:
-                    tts.speak_sync("Не удалось перейти дальше.", lang_code); continue
+    def run() -> dict:
+        try:
+            res = analyze_fen_progressive(board.fen(), depths=_PV_DEPTHS, on_update=publish, cancel=cancel)
+        except Exception as e:
+            if not first.done():
+                first.set_exception(e)
+            raise
+        if res:
+            eval_cache.put(key, res)
+        publish(res)
+        return res
+
+    return first, _POOL.submit(run)
+
+def _best_so_far(best) -> dict:
+    """The deepest PV already available; waits only for the shallow one."""
+    first, final = best
+    return (final.result() if final.done() else first.result()) or {}
+
+def _prefetch_branch(coach: CoachSession, branch_info: Optional[dict] = None):
+    """Start the branch analysis (mistake check + best/alternatives) and the short PV for the current position."""
+    st = coach.state
+    board_now = st.board.copy(stack=False)
+    move = st.nodes_mainline[st.ply_idx].move if st.game and st.ply_idx < len(st.nodes_mainline) else None
+    # the speculation already running for this very branch becomes the real work; any other one is aborted
+    reused = _take_speculation(coach, board_now, move)
+    if reused is not None:
+        fut_branch, best = reused
+    else:
+        fut_branch, best = None, _engine_best_progressive(board_now)
+    if isinstance(branch_info, dict):
+        # the deep result lands here silently, for later intents (choose, ask)
+        def keep(f: concurrent.futures.Future):
+            if not f.cancelled() and f.exception() is None:
+                branch_info["engine_best"] = f.result()
+        best[1].add_done_callback(keep)
+    if fut_branch is None:
+        fut_branch = _POOL.submit(_engine_branch, coach, board_now, move, 18)
+    return fut_branch, best
+
+# the speculative branch a 'continue' would reach: {"board", "move", "cancel", "branch", "best"}.
+# Its searches hold coach.sf / the shared engine, so they are cancellable: an intent that needs
+# the engine must not wait behind a result it may never use.
+_spec: Optional[dict] = None
+# intents that may consume the speculated branch; any other intent aborts the speculation
+_USES_SPECULATION = ("continue", "confirm")
+
+def _abort_speculation(coach: Optional[CoachSession]):
+    global _spec
+    spec, _spec = _spec, None
+    if spec is None:
+        return
+    if coach is not None:
+        coach.sf.cancel_search(spec["cancel"])
+    if not spec["best"][1].done():  # its job is queued or searching on the shared engine
+        shared_engine().cancel_search(spec["cancel"])
+
+def _take_speculation(coach: CoachSession, board: chess.Board, move: Optional[chess.Move]):
+    """(branch future, best futures) of a live speculation for exactly this branch, else None (and abort it)."""
+    global _spec
+    spec = _spec
+    if spec is not None and not spec["cancel"].is_set() and spec["move"] == move and spec["board"] == board:
+        _spec = None  # now owned by the real prefetch: later intents must not cancel it
+        return spec["branch"], spec["best"]
+    _abort_speculation(coach)
+    return None
+
+def _speculate_next_branch(coach: CoachSession):
+    """
+    While the user listens and thinks, analyse the branch a 'continue' would reach:
+    the results land in eval_cache and that branch is then announced without waiting for the engine.
+    """
+    global _spec
+    _abort_speculation(coach)
+    try:
+        nxt = coach.next_branch_position()
+    except Exception:
+        return
+    if nxt is None or nxt[0] == coach.state.board:
+        return
+    board_next, move_next = nxt
+    cancel = threading.Event()
+    _spec = {
+        "board": board_next, "move": move_next, "cancel": cancel,
+        "branch": _POOL.submit(_engine_branch, coach, board_next, move_next, 18, cancel),
+        "best": _engine_best_progressive(board_next, cancel),
+    }
 
-                # 1) Проговорим, какие ходы прошли по мейнлайну с прошлой развилки
-                prev_idx = 0
-                try:
-                    if last_branch_info and "branch_ply" in last_branch_info:
-                        prev_idx = int(last_branch_info["branch_ply"])
-                except Exception:
-                    prev_idx = 0
-
-                curr_idx = int(info.get("branch_ply", prev_idx))
-                path_all = info.get("path_san") or []
-                segment = path_all[prev_idx:curr_idx]
-                if segment:
-                    tts.speak_sync(pv_to_speech(segment), lang_code)
-
-                last_branch_info = info
-
-                # 2) Tell what you actually played on this new branching point
-                mist = coach.detect_mistake_on_next_main_move(depth=18)
-                played = (mist.get("played_san") or "")
-                best_for_mist = (mist.get("best_san") or "")
-                mark = (mist.get("mark") or "")
-                quality = {"": "нормальный", "?!": "неточный", "?": "ошибочный", "??": "зевок"}.get(mark, "нормальный")
-
-                # Who is to move now?
-                is_user_to_move = (coach.state.user_side is not None and coach.state.user_side == coach.state.board.turn)
-                who = "Ты" if is_user_to_move else "Соперник"
-
-                if played:
-                    if best_for_mist and best_for_mist == played:
-                        # user's (or opponent's) move equals engine's first line
-                        tts.speak_sync(f"{who.lower()} сыграл: {san_to_speech(played)}. Это первая линия.", lang_code)
-                    else:
-                        tts.speak_sync(f"{who.lower()} сыграл: {san_to_speech(played)}. Это {quality} ход.", lang_code)
+# PV → SAN-токены: без номеров ходов ("12." / "12...") и многоточий, только первые n
+_RE_PV_TOKEN = re.compile(r"[^\s,]+")
+_RE_PV_MOVENUM = re.compile(r"\d+\.+")
+
+def _pv_first_tokens(pv, n: int) -> List[str]:
+    """First n SAN moves of a PV given as a list or as a numbered string; stops scanning after n."""
+    if isinstance(pv, list):
+        return [t.strip() for t in pv[:n * 3] if t and t.strip()][:n]
+    out: List[str] = []
+    for m in _RE_PV_TOKEN.finditer(pv or ""):
+        tok = m.group()
+        num = _RE_PV_MOVENUM.match(tok)
+        if num:
+            tok = tok[num.end():]  # "12." / "12..." / "1.e4"
+        if tok and tok.strip(".…"):
+            out.append(tok)
+            if len(out) >= n:
+                break
+    return out
 
+def _announce_branch(coach: CoachSession, tts: TTSManager, lang: str, info: dict, prefetch,
+                     where: str = "") -> bool:
+    """
+    Common part of confirm/continue at a branch point: the played move and its quality,
+    the engine's first line and equal alternatives (stored in info["engine_alts"] as (san, spoken) for 'choose').
+    prefetch is what _prefetch_branch returned. True → alternatives were offered, wait for a choice.
+    """
+    fut_branch, best_pv = prefetch
+    branch = fut_branch.result()
+    mist = branch.get("mist") or {}
+    played = mist.get("played_san") or ""
+    best_for_mist = mist.get("best_san") or ""
+    quality = _QUALITY_RU.get(mist.get("mark") or "", "нормальный")
+
+    if played:
+        # Who is to move now?
+        is_user_to_move = (coach.state.user_side is not None and coach.state.user_side == coach.state.board.turn)
+        who_low = "ты" if is_user_to_move else "соперник"
+        # user's (or opponent's) move equals engine's first line → no quality mark
+        verdict = "первая линия" if best_for_mist == played else f"{quality} ход"
+        tts.speak_async(f"{where}{who_low} сыграл: {san_to_speech(played)}. Это {verdict}.", lang)
+
+    # Engine: best line + equal-strength alternatives (never duplicate the best)
+    opts = branch.get("opts") or {}
+    best_san = opts.get("best_san") or ""
+    equal_alts = [a for a in (opts.get("equal_alts") or []) if a and a != best_san and a != played]
+    info["engine_alts"] = [(a, san_to_speech(a)) for a in equal_alts]
+    info["engine_alts_cp"] = [None] * len(equal_alts)  # what_if_san result per chosen alternative
+
+    # Short PV for the best line (≈2 full moves)
+    pv_spoken = ""
+    try:
+        pv = _pv_first_tokens(_best_so_far(best_pv).get("pv") or [], 4)
+        pv_spoken = pv_to_speech(pv) if pv else ""
+    except Exception:
+        pv_spoken = ""
+
+    # Engine's first line (skipped if it is exactly the played move)
+    _announce_engine_line(best_san, pv_spoken, played, tts, lang)
+
+    _speculate_next_branch(coach)
+
+    if equal_alts:
+        alts_spoken = [spoken for _, spoken in info["engine_alts"][:2]]
+        tts.speak_sync("Альтернативы: " + ", ".join(alts_spoken) + ".", lang)
+        return True
+    return False
+
+# ---------- intent handlers: one function per intent, dispatched through _HANDLERS ----------
+@dataclass
+class _AssistantState:
+    """State of one voice session shared by the intent handlers."""
+    tts: TTSManager
+    lang_code: str
+    log_fn: Callable[[str], None]
+    coach: Optional[CoachSession] = None
+    last_reply: str = ""
+    awaiting_confirm_to_start: bool = False
+    awaiting_variant_choice: bool = False
+    last_branch_info: Optional[dict] = None
+    awaiting_mistake_query: bool = False      # ждём "как правильно?"
+    last_mistake_hint: Optional[dict] = None  # {"played_san":..., "best_san":..., "cpl":..., "mark":...}
+
+def _handle_exit(s: _AssistantState, intent: dict, text: str) -> Optional[bool]:
+    tts, lang_code = s.tts, s.lang_code
+    tts.speak_sync(COMMANDS[lang_code]["bye"], lang_code)
+    return True
+
+def _handle_start_opponent(s: _AssistantState, intent: dict, text: str) -> Optional[bool]:
+    tts, lang_code, log_fn = s.tts, s.lang_code, s.log_fn
+    data = intent.get("data", {}) or {}
+    opp = (data.get("opponent") or "").strip()
+    if not opp:
+        tts.speak_sync("Не расслышал имя соперника.", lang_code)
+        return
+    if s.coach:
+        s.coach.reset()  # same Stockfish process, warm hash
+    else:
+        s.coach = CoachSession(str(ENGINE_PATH))
+    pgn_path = CoachSession.find_pgn_by_opponent(ANALYSIS_DIRS, opp)
+    if not pgn_path:
+        existing = [str(p) for p in ANALYSIS_DIRS if p.exists()]
+        log_fn(f"[search] Not found. Searched in: {', '.join(existing)}")
+        tts.speak_sync("Не нашел такую партию.", lang_code)
+        return
+    s.coach.load_pgn(pgn_path)
+    s.awaiting_confirm_to_start = True
+    s.awaiting_variant_choice = False
+    s.last_branch_info = None
+    tts.speak_sync(COMMANDS[lang_code]["opened"], lang_code)  # «Открыто. Готов начать просмотр?»
+
+def _handle_start_latest(s: _AssistantState, intent: dict, text: str) -> Optional[bool]:
+    tts, lang_code, log_fn = s.tts, s.lang_code, s.log_fn
+    if _RE_VS.search(text):
+        tts.speak_sync("Не расслышал имя соперника.", lang_code)
+        return
+    data = intent.get("data", {}) or {}
+    today_only = bool(data.get("today", True))
+    if s.coach:
+        s.coach.reset()  # same Stockfish process, warm hash
+    else:
+        s.coach = CoachSession(str(ENGINE_PATH))
+    pgn_path = CoachSession.find_latest_pgn(ANALYSIS_DIRS, today_only=today_only)
+    if not pgn_path:
+        existing = [str(p) for p in ANALYSIS_DIRS if p.exists()]
+        log_fn(f"[latest] Not found. Searched in: {', '.join(existing)}")
+        tts.speak_sync("Партия не найдена.", lang_code)
+        return
+    s.coach.load_pgn(pgn_path)
+    s.awaiting_confirm_to_start = True
+    s.awaiting_variant_choice = False
+    s.last_branch_info = None
+    tts.speak_sync(COMMANDS[lang_code]["opened"], lang_code)
+
+def _handle_goto_by_san(s: _AssistantState, intent: dict, text: str) -> Optional[bool]:
+    coach, tts, lang_code = s.coach, s.tts, s.lang_code
+    if not (coach and coach.state.game):
+        tts.speak_sync("Партия не открыта.", lang_code); return
+
+    data = intent.get("data", {}) or {}
+    phrase = text or ""
+
+    # --- эвристика: фразы типа «посмотрим/вариант/посмотри/покажи» => это анализ (what_if)
+    wants_analysis = bool(_RE_WANTS_ANALYSIS.search(phrase))
+
+    # распознаём рокировку в естественной форме
+    castling_san = castling_from_words(phrase)
+
+    if wants_analysis or castling_san:
+        # → Перенаправляем в «анализ варианта»
+        san = extract_variant_san(phrase, data, coach.state.board)
+        if not san:
+            tts.speak_sync("Не распознала вариант. Повторите, пожалуйста.", lang_code); return
+
+        res = coach.what_if_san(san, depth=23, multipv=2, show_progress=True)
+        if "error" in res:
+            tts.speak_sync("Ошибка в варианте: " + res["error"], lang_code); return
+        lines = res.get("lines", [])
+        if not lines:
+            tts.speak_sync("Нет варианта от движка.", lang_code); return
+
+        def fmt_cp(cp: int) -> str:
+            return "мат" if abs(cp) >= 9000 else f"{cp/100.0:+.2f}"
+
+        tts.speak_async(f"Проверила: {san_to_speech(san)}. {fmt_cp(lines[0]['cp'])}.", lang_code)
+        try:
+            pv_spoken = pv_to_speech(_pv_first_tokens(lines[0].get("pv_san") or "", 6))  # до 3 полных ходов
+            if pv_spoken:
+                tts.speak_sync(pv_spoken, lang_code)
+        except Exception:
+            pass
+        # Ждём «продолжай» или новый запрос
+        return
+
+    # --- обычный сценарий «перейти к моменту SAN» (goto) ---
+    san = (data.get("san") or "").strip()
+    if not san:
+        san = (maybe_extract_san(phrase) or "").strip()
+    if not san:
+        tts.speak_sync("Не расслышал ход.", lang_code); return
+
+    st = coach.goto_by_san(san)
+    if "error" in st:
+        tts.speak_sync("Не нашел такой ход в мейнлайне.", lang_code)
+    else:
+        tts.speak_sync("Готово.", lang_code)
+
+def _handle_confirm(s: _AssistantState, intent: dict, text: str) -> Optional[bool]:
+    coach, tts, lang_code = s.coach, s.tts, s.lang_code
+    if s.awaiting_confirm_to_start and coach and coach.state.game:
+        info = coach.autoplay_to_first_branch(min_fullmove=4, max_fullmove=6)
+        if "error" in info:
+            tts.speak_sync("Не удалось начать просмотр.", lang_code)
+            return
+        s.awaiting_confirm_to_start = False
+        s.last_branch_info = info
+        # engine work for this branch starts now and overlaps with the speech below
+        prefetch = _prefetch_branch(coach, info)
+
+        # Say opening name only once per session
+        name = coach.opening_name_once()
+        if name:
+            # Собираем аккуратную русскую фразу про дебют
+            try:
+                # Попробуем вытащить пару первых «книжных» ходов для красивой концовки
+                book = coach.opening_info_current(top_n=3)
+                top = [m["san"] for m in (book.get("top") or [])]
+                phrase = opening_title_to_speech(title_ru=name, moves_line=top[:3])
+                tts.speak_async(phrase, lang_code)
+            except Exception:
+                tts.speak_async(f"Это {name}.", lang_code)
+        # Озвучим первые ходы партии до развилки
+        path = info.get("path_san") or []
+        if path:
+            tts.speak_async("Начало партии: " + pv_to_speech(path), lang_code)
+
+        s.awaiting_variant_choice = _announce_branch(coach, tts, lang_code, info, prefetch,
+                                                     where="В этой позиции ")
+    else:
+        return _handle_continue(s, intent, text)
+
+def _handle_choose(s: _AssistantState, intent: dict, text: str) -> Optional[bool]:
+    coach, tts, lang_code = s.coach, s.tts, s.lang_code
+    if not (coach and coach.state.game and s.last_branch_info and s.awaiting_variant_choice):
+        tts.speak_sync("Сейчас не жду выбора варианта.", lang_code); return
+    idx = int((intent.get("data", {}) or {}).get("index") or 1)
+    info = s.last_branch_info
+    alt_list = info.get("engine_alts") or []
+    if not alt_list:
+        alt_list = info["engine_alts"] = [(a, san_to_speech(a)) for a in info.get("alt_first", [])]
+        info["engine_alts_cp"] = [None] * len(alt_list)
+    if not (1 <= idx <= len(alt_list)):
+        tts.speak_sync("Такого варианта нет.", lang_code); return
+    first_move, first_move_spoken = alt_list[idx-1]
+    # Глубокий анализ выбранной альтернативы (d=23) с прогрессом в консоли; повторный выбор — из кэша
+    cache = info.get("engine_alts_cp") or [None] * len(alt_list)
+    res = cache[idx-1]
+    if res is None:
+        res = coach.what_if_san(first_move, depth=23, multipv=2, show_progress=True)
+        if "error" in res:
+            tts.speak_sync("Ошибка в варианте.", lang_code); return
+        cache[idx-1] = res
+        info["engine_alts_cp"] = cache
+    lines = res.get("lines", [])
+    if not lines:
+        tts.speak_sync("Нет варианта от движка.", lang_code); return
+    def fmt_cp(cp: int) -> str:
+        return "мат" if abs(cp) >= 9000 else f"{cp/100.0:+.2f}"
+    summary = " ; ".join([f"{i['idx']}) {fmt_cp(i['cp'])}" for i in lines[:2]])
+    tts.speak_async(f"Проверила: {first_move_spoken}. {summary}. Продолжать?", lang_code)
+    # Озвучим первый вариант движка (2–3 полных хода)
+    try:
+        pv_spoken = pv_to_speech(_pv_first_tokens(lines[0].get("pv_san") or "", 6))
+        if pv_spoken:
+            tts.speak_sync(pv_spoken, lang_code)
+    except Exception:
+        pass
 
-                # 3) Engine best + equal alternatives (no duplication)
-                opts = coach.first_line_and_equal_alts(depth=16, multipv=3)
-                best_san = opts.get("best_san") or ""
-                equal_alts_raw = opts.get("equal_alts") or []
-                played = (mist.get("played_san") or "")
-                equal_alts = [a for a in equal_alts_raw if a and a != best_san and a != played]
-                if isinstance(last_branch_info, dict):
-                    last_branch_info["engine_alts"] = equal_alts
+    s.awaiting_variant_choice = False  # дальше слушаем «продолжай» или новые запросы
 
-                pv_spoken = ""
-                try:
-                    fen_now = coach.state.board.fen()
-                    best_info = analyze_fen(fen_now, depth=16) or {}
-                    pv = best_info.get("pv") or []
-                    # всегда приводим к списку SAN-токенов
-                    if isinstance(pv, str):
-                        pv = [t for t in strip_move_numbers(pv).split() if t]
-                    if isinstance(pv, list):
-                        pv = [t.strip() for t in pv if t.strip()]
-                    pv_spoken = pv_to_speech(pv[:4]) if pv else ""
-                except Exception:
-                    pv_spoken = ""
-                
-                # Skip speaking engine's first line if it matches the played move
-                played_now = (mist.get("played_san") or "")
-                if played_now and best_san and played_now == best_san:
-                    # Do not speak the first line block at all
-                    pass
-                else:
-                    if best_san:
-                        if pv_spoken:
-                            tts.speak_sync(f"Первая линия движка: {pv_spoken}.", lang_code)
-                        else:
-                            tts.speak_sync(f"Первая линия движка: {san_to_speech(best_san)}.", lang_code)
-
-                if best_san:
-                    if pv_spoken:
-                        tts.speak_sync(f"Первая линия движка: {pv_spoken}.", lang_code)
-                    else:
-                        tts.speak_sync(f"Первая линия движка: {san_to_speech(best_san)}.", lang_code)
+def _handle_continue(s: _AssistantState, intent: dict, text: str) -> Optional[bool]:
+    coach, tts, lang_code = s.coach, s.tts, s.lang_code
+    if not (coach and coach.state.game):
+        tts.speak_sync("Партия не открыта.", lang_code); return
+    # шаг по мейнлайну до следующей развилки (или просто +1/-? — выберем до следующей развилки)
+    info = coach.autoplay_to_first_branch(
+        min_fullmove=coach.state.board.fullmove_number+1,
+        max_fullmove=999
+    )
+    if "error" in info:
+        tts.speak_sync("Не удалось перейти дальше.", lang_code); return
+    prefetch = _prefetch_branch(coach, info)
 
-                if equal_alts:
-                    alts_spoken = [san_to_speech(x) for x in equal_alts[:2]]
-                    phr = "Альтернативы: " + ", ".join(alts_spoken)
-                    tts.speak_sync(phr + ".", lang_code)
-                    awaiting_variant_choice = True
-                else:
-                    awaiting_variant_choice = False
-
-            elif it == "what_if":
-                if not (coach and coach.state.game):
-                    tts.speak_sync("Сначала откроем партию.", lang_code); continue
-                data = intent.get("data", {}) or {}
-                san_line = extract_variant_san(text, data, coach.state.board)
-                if not san_line:
-                    tts.speak_sync("Не распознала вариант. Повторите, пожалуйста.", lang_code); continue
-                # Deep (d=23) with visible progress in console
-                res = coach.what_if_san(san_line, depth=23, multipv=2, show_progress=True)
-                if "error" in res:
-                    tts.speak_sync("Ошибка в варианте: " + res["error"], lang_code); continue
-                lines = res.get("lines", [])
-                if not lines:
-                    tts.speak_sync("Нет варианта от движка.", lang_code); continue
-
-                # Возьмём главную PV, почистим от номеров и озвучим
-                pv_full: str = (lines[0].get("pv_san") or "")
-                pv_clean = strip_move_numbers(pv_full)
-                pv_tokens: list[str] = [t for t in pv_clean.split() if t]
-                pv_short: list[str] = pv_tokens[:6] if len(pv_tokens) >= 2 else pv_tokens  # до ~3 полных ходов
-
-                if len(pv_short) > 0:
-                    tts.speak_sync("Вариант: " + pv_to_speech(pv_short), lang_code)
-                else:
-                    try:
-                        pv0 = (lines[0].get("pv_san") or "")
-                        pv_clean = strip_move_numbers(pv0)
-                        pv_tokens = [t for t in pv_clean.split() if t]
-                        pv_spoken = pv_to_speech(pv_tokens[:6])
-                        if pv_spoken:
-                            tts.speak_sync("Вариант: " + pv_spoken, lang_code)
-                        else:
-                            tts.speak_sync("Вариант пустой.", lang_code)
-                    except Exception:
-                        tts.speak_sync("Вариант пустой.", lang_code)
-                    awaiting_variant_choice = False
-            elif it == "goto":
-                if not (coach and coach.state.game):
-                    tts.speak_sync("Партия не открыта.", lang_code); continue
-                data = intent.get("data", {}) or {}
-                move = int(data.get("move") or 1)
-                side = data.get("side")
-                # Переход просто к полуходу перед указанным ходом/стороной
-                st0 = coach.current_status()
-                st = coach.goto_ply(0)  # к началу, затем пройдём до нужного
-                # Грубая навигация: сходим к ближайшей развилке после указанного хода
-                start_mv = max(1, move)
-                info = coach.autoplay_to_first_branch(min_fullmove=start_mv, max_fullmove=999)
-                last_branch_info = info if "error" not in info else None
-                tts.speak_sync("Готово.", lang_code)
-
-            elif it == "step":
-                if not (coach and coach.state.game):
-                    tts.speak_sync("Партия не открыта.", lang_code); continue
-                data = intent.get("data", {}) or {}
-                delta = int(data.get("delta") or 0)
-                st = coach.goto_ply(coach.state.ply_idx + delta)
-                if "error" in st:
-                    tts.speak_sync("Не удалось сделать шаг.", lang_code); continue
-                tts.speak_sync("Готово.", lang_code)
-
-            elif it == "start":
-                if not (coach and coach.state.game):
-                    tts.speak_sync("Партия не открыта.", lang_code); continue
-                coach.goto_ply(0)
-                tts.speak_sync("Готово.", lang_code)
-
-            elif it == "end":
-                if not (coach and coach.state.game):
-                    tts.speak_sync("Партия не открыта.", lang_code); continue
-                coach.goto_ply(len(coach.state.nodes_mainline))
-                tts.speak_sync("Готово.", lang_code)
-
-            elif it == "ask":
-                if not (coach and coach.state.game):
-                    tts.speak_sync("Сначала откроем партию.", lang_code); continue
-                q = (intent.get("data", {}) or {}).get("question") or text
-
-                # 1) Если ждали ответа на ошибку и пользователь спросил «как было правильно»
-                if awaiting_mistake_query and is_ask_how_correct(q):
-                    awaiting_mistake_query = False
-                    best_san = (last_mistake_hint or {}).get("best_san") or ""
-                    if best_san:
-                        tts.speak_sync(f"Правильно: {san_to_speech(best_san)}.", lang_code)
-                    else:
-                        # fallback — просто взять лучший ход сейчас
-                        qe = coach.quick_eval(depth=18, multipv=1)
-                        lines = qe.get("lines", [])
-                        if lines and lines[0].get("pv_san"):
-                            first = lines[0]["pv_san"].split()[0]
-                            tts.speak_sync(f"Правильно: {san_to_speech(first)}.", lang_code)
-                        else:
-                            tts.speak_sync("Сейчас лучшего хода не вижу.", lang_code)
-                    continue
+    # 1) Проговорим, какие ходы прошли по мейнлайну с прошлой развилки
+    prev_idx = 0
+    try:
+        if s.last_branch_info and "branch_ply" in s.last_branch_info:
+            prev_idx = int(s.last_branch_info["branch_ply"])
+    except Exception:
+        prev_idx = 0
+
+    curr_idx = int(info.get("branch_ply", prev_idx))
+    path_all = info.get("path_san") or []
+    segment = path_all[prev_idx:curr_idx]
+    if segment:
+        tts.speak_async(pv_to_speech(segment), lang_code)
+
+    s.last_branch_info = info
+    s.awaiting_variant_choice = _announce_branch(coach, tts, lang_code, info, prefetch)
+
+def _handle_what_if(s: _AssistantState, intent: dict, text: str) -> Optional[bool]:
+    coach, tts, lang_code = s.coach, s.tts, s.lang_code
+    if not (coach and coach.state.game):
+        tts.speak_sync("Сначала откроем партию.", lang_code); return
+    data = intent.get("data", {}) or {}
+    san_line = extract_variant_san(text, data, coach.state.board)
+    if not san_line:
+        tts.speak_sync("Не распознала вариант. Повторите, пожалуйста.", lang_code); return
+    # Deep (d=23) with visible progress in console
+    res = coach.what_if_san(san_line, depth=23, multipv=2, show_progress=True)
+    if "error" in res:
+        tts.speak_sync("Ошибка в варианте: " + res["error"], lang_code); return
+    lines = res.get("lines", [])
+    if not lines:
+        tts.speak_sync("Нет варианта от движка.", lang_code); return
+
+    # Возьмём главную PV без номеров ходов и озвучим
+    pv_short = _pv_first_tokens(lines[0].get("pv_san") or "", 6)  # до ~3 полных ходов
+    if pv_short:
+        tts.speak_sync("Вариант: " + pv_to_speech(pv_short), lang_code)
+    else:
+        tts.speak_sync("Вариант пустой.", lang_code)
+        s.awaiting_variant_choice = False
+
+def _handle_goto(s: _AssistantState, intent: dict, text: str) -> Optional[bool]:
+    coach, tts, lang_code = s.coach, s.tts, s.lang_code
+    if not (coach and coach.state.game):
+        tts.speak_sync("Партия не открыта.", lang_code); return
+    data = intent.get("data", {}) or {}
+    move = int(data.get("move") or 1)
+    side = data.get("side")
+    # Грубая навигация: сходим к ближайшей развилке после указанного хода
+    # (autoplay_to_first_branch сам ставит доску на развилку от начала партии)
+    start_mv = max(1, move)
+    info = coach.autoplay_to_first_branch(min_fullmove=start_mv, max_fullmove=999)
+    s.last_branch_info = info if "error" not in info else None
+    tts.speak_sync("Готово.", lang_code)
+
+def _handle_step(s: _AssistantState, intent: dict, text: str) -> Optional[bool]:
+    coach, tts, lang_code = s.coach, s.tts, s.lang_code
+    if not (coach and coach.state.game):
+        tts.speak_sync("Партия не открыта.", lang_code); return
+    data = intent.get("data", {}) or {}
+    delta = int(data.get("delta") or 0)
+    st = coach.goto_ply(coach.state.ply_idx + delta)
+    if "error" in st:
+        tts.speak_sync("Не удалось сделать шаг.", lang_code); return
+    tts.speak_sync("Готово.", lang_code)
+
+def _handle_start(s: _AssistantState, intent: dict, text: str) -> Optional[bool]:
+    coach, tts, lang_code = s.coach, s.tts, s.lang_code
+    if not (coach and coach.state.game):
+        tts.speak_sync("Партия не открыта.", lang_code); return
+    coach.goto_ply(0)
+    tts.speak_sync("Готово.", lang_code)
+
+def _handle_end(s: _AssistantState, intent: dict, text: str) -> Optional[bool]:
+    coach, tts, lang_code = s.coach, s.tts, s.lang_code
+    if not (coach and coach.state.game):
+        tts.speak_sync("Партия не открыта.", lang_code); return
+    coach.goto_ply(len(coach.state.nodes_mainline))
+    tts.speak_sync("Готово.", lang_code)
+
+def _handle_ask(s: _AssistantState, intent: dict, text: str) -> Optional[bool]:
+    coach, tts, lang_code = s.coach, s.tts, s.lang_code
+    if not (coach and coach.state.game):
+        tts.speak_sync("Сначала откроем партию.", lang_code); return
+    q = (intent.get("data", {}) or {}).get("question") or text
+
+    # 1) Если ждали ответа на ошибку и пользователь спросил «как было правильно»
+    if s.awaiting_mistake_query and is_ask_how_correct(q):
+        s.awaiting_mistake_query = False
+        best_san = (s.last_mistake_hint or {}).get("best_san") or ""
+        if best_san:
+            tts.speak_sync(f"Правильно: {san_to_speech(best_san)}.", lang_code)
+        else:
+            # fallback — просто взять лучший ход сейчас
+            qe = coach.quick_eval(depth=18, multipv=1)
+            lines = qe.get("lines", [])
+            if lines and lines[0].get("pv_san"):
+                first = lines[0]["pv_san"].split()[0]
+                tts.speak_sync(f"Правильно: {san_to_speech(first)}.", lang_code)
+            else:
+                tts.speak_sync("Сейчас лучшего хода не вижу.", lang_code)
+        return
+
+    # 2) Если в фразе явно есть один SAN-ход — проверим его как «что если»
+    san_guess = maybe_extract_san(q)
+    if san_guess:
+        res = coach.what_if_san(san_guess, depth=20, multipv=2, show_progress=True)
+        if "error" in res:
+            tts.speak_sync("Не смогла разобрать этот ход.", lang_code); return
+        lines = res.get("lines", [])
+        if not lines:
+            tts.speak_sync("Движок не дал варианта.", lang_code); return
+        def fmt_cp(cp: int) -> str:
+            return "мат" if abs(cp) >= 9000 else f"{cp/100.0:+.2f}"
+        # кратко: покажем оценку первой линии
+        tts.speak_sync(f"После {san_to_speech(san_guess)}: {fmt_cp(lines[0]['cp'])}.", lang_code)
+        return
+
+    # 3) Иначе — обычный короткий ответ-план
+    reply = coach.coach_reply(q, depth=18)
+    tts.speak_sync(reply, lang_code)
+    s.last_reply = reply
+
+# a handler returns True to end the session
+_HANDLERS: Dict[str, Callable[[_AssistantState, dict, str], Optional[bool]]] = {
+    "exit": _handle_exit,
+    "start_opponent": _handle_start_opponent,
+    "start_latest": _handle_start_latest,
+    "goto_by_san": _handle_goto_by_san,
+    "confirm": _handle_confirm,
+    "choose": _handle_choose,
+    "continue": _handle_continue,
+    "what_if": _handle_what_if,
+    "goto": _handle_goto,
+    "step": _handle_step,
+    "start": _handle_start,
+    "end": _handle_end,
+    "ask": _handle_ask,
+}
 
-                # 2) Если в фразе явно есть один SAN-ход — проверим его как «что если»
-                san_guess = maybe_extract_san(q)
-                if san_guess:
-                    res = coach.what_if_san(san_guess, depth=20, multipv=2, show_progress=True)
-                    if "error" in res:
-                        tts.speak_sync("Не смогла разобрать этот ход.", lang_code); continue
-                    lines = res.get("lines", [])
-                    if not lines:
-                        tts.speak_sync("Движок не дал варианта.", lang_code); continue
-                    def fmt_cp(cp: int) -> str:
-                        return "мат" if abs(cp) >= 9000 else f"{cp/100.0:+.2f}"
-                    # кратко: покажем оценку первой линии
-                    tts.speak_sync(f"После {san_to_speech(san_guess)}: {fmt_cp(lines[0]['cp'])}.", lang_code)
-                    continue
+def run_assistant(lang_code: str, log_fn, stop_event: threading.Event, on_done, tts: TTSManager):
+    state = _AssistantState(tts=tts, lang_code=lang_code, log_fn=log_fn)
+    # capture and ASR run in their own threads: the mic keeps listening while a phrase is transcribed
+    pipe_stop = threading.Event()
+    captured_q: "queue.Queue[bytes]" = queue.Queue()
+    asr_q: "queue.Queue[str]" = queue.Queue()
+
+    try:
+        init_asr(model_size="large-v3", device="cpu", compute_type="int8")
+        tts.speak_sync(COMMANDS[lang_code]["hello"], lang_code)
+
+        threading.Thread(target=_capture_loop, args=(log_fn, pipe_stop, captured_q, tts), daemon=True).start()
+        threading.Thread(target=_asr_loop, args=(lang_code, log_fn, pipe_stop, captured_q, asr_q),
+                         daemon=True).start()
+
+        while not stop_event.is_set():
+            try:
+                text = asr_q.get(timeout=0.2).strip()
+            except queue.Empty:
+                continue
+            if not text:
+                continue
 
-                # 3) Иначе — обычный короткий ответ-план
-                reply = coach.coach_reply(q, depth=18)
-                tts.speak_sync(reply, lang_code)
-                last_reply = reply
+            intent = understand_with_llm(text, lang_code)
+            if intent.get("intent") not in _USES_SPECULATION:
+                _abort_speculation(state.coach)
+            handler = _HANDLERS.get(intent.get("intent", "unknown"))
+            if handler is not None and handler(state, intent, text):
+                break
 
     except Exception as e:
         log_fn(f"Fatal error: {e}")
     finally:
+        pipe_stop.set()
         try:
-            if coach:
-                coach.close()
+            if state.coach:
+                state.coach.close()
         except Exception:
             pass
         on_done()
@@ -1153,6 +1857,7 @@ class AnalyzeGameDialog(tk.Toplevel):
         self.result: Optional[dict] = None
 
         self.selected_path = tk.StringVar()
+        self._cached_plies: Optional[int] = None  # plies of the selected file (depends only on the file)
         self.file_label_var = tk.StringVar(value="—")
         self.depth_var = tk.IntVar(value=max(15, min(30, int(initial_depth or 20))))
         self.eta_var = tk.StringVar(value="—")
@@ -1232,14 +1937,18 @@ class AnalyzeGameDialog(tk.Toplevel):
                 self.file_label_var.set(os.path.basename(path))
             except Exception:
                 self.file_label_var.set(path)
+            self._recount_plies()
             self._update_eta()
 
-    def _estimate_seconds(self):
+    def _recount_plies(self):
         path = self.selected_path.get()
-        if not path:
+        self._cached_plies = count_plies_in_pgn(path) if path else None
+
+    def _estimate_seconds(self):
+        plies = self._cached_plies
+        if plies is None:
             self.eta_var.set("—")
             return
-        plies = count_plies_in_pgn(path)
         try:
             depth = int(self.depth_var.get() or 20)
         except Exception:
@@ -1274,6 +1983,7 @@ class AnalyzeGameDialog(tk.Toplevel):
             "depth": int(self.depth_var.get()),
             "multipv": int(self.var_multipv.get() or 3),
             "pv_moves": int(self.var_pvlen.get() or 6),  # full moves
+            "plies": self._cached_plies,
         }
         self.grab_release(); self.destroy()
 
@@ -1282,6 +1992,13 @@ class AnalyzeGameDialog(tk.Toplevel):
         self.grab_release(); self.destroy()
 
 
+def _fmt_eta_text(pct: int, seconds: int) -> str:
+    if seconds < 60:
+        return f"{pct}% — {seconds} sec left"
+    m, s = divmod(int(seconds), 60)
+    return f"{pct}% — {m} min {s} sec left"
+
+
 class App(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -1318,6 +2035,14 @@ class App(tk.Tk):
         self.worker = None
         self.stop_event = threading.Event()
 
+        # Worker threads never touch widgets: they post here, _drain_ui applies a batch every 50 ms
+        self._ui_q: "queue.Queue[tuple]" = queue.Queue()
+        # Analysis progress is a single latest-value slot, not queue items: (pct, eta sec) or None
+        self._prog_lock = threading.Lock()
+        self._prog_state: Optional[Tuple[int, int]] = None
+        self._prog_shown: Optional[Tuple[int, int]] = None
+        self.after(50, self._drain_ui)
+
         self.log("Ready. Choose 'edge – Neural (online)' for best voices. 'Heard:' lines only.")
         self.status_var = tk.StringVar(value="Ready.")
         self.status_label = tk.Label(self, textvariable=self.status_var, anchor="w")
@@ -1349,7 +2074,9 @@ class App(tk.Tk):
         multipv = int(res.get("multipv", 3))
         pv_moves = int(res.get("pv_moves", 6))
 
-        plies = count_plies_in_pgn(p)
+        plies = res.get("plies")
+        if plies is None:
+            plies = count_plies_in_pgn(p)
         eta_hint = eta_predict_seconds(plies, depth, multipv, pv_moves)
 
         self._set_status(f"Analyzing: {p.name}, depth {depth}, MultiPV {multipv}, PV {pv_moves}…")
@@ -1378,12 +2105,6 @@ class App(tk.Tk):
         self.progress_text.pack(fill="x", padx=8, pady=(0, 8))
         self.progress_label.set("0% — estimating…")
 
-        def _fmt_eta_text(pct: int, seconds: int) -> str:
-            if seconds < 60:
-                return f"{pct}% — {seconds} sec left"
-            m, s = divmod(int(seconds), 60)
-            return f"{pct}% — {m} min {s} sec left"
-        
         plies = precomputed_plies if precomputed_plies is not None else count_plies_in_pgn(pgn_path)
         if eta_hint is None:
             eta_hint = eta_predict_seconds(plies, depth, multipv, pv_moves)
@@ -1391,49 +2112,46 @@ class App(tk.Tk):
         # Initialize ETA label once and DO NOT reset start_ts again
         start_ts = time.time()
         self.progress_label.set(_fmt_eta_text(0, int(eta_hint)))
+        with self._prog_lock:
+            self._prog_state = self._prog_shown = (0, int(eta_hint))
 
         # Smoothing state for ETA
         eta_prev = float(eta_hint)    # last displayed ETA (sec)
         eta_smooth = float(eta_hint)  # EMA buffer
 
-        def progress_cb(done: int, total: int):
+        eta_hint_f = float(eta_hint)
+        _blend_k = 1.0 / 0.35   # alpha: 0 at 15% → 1 at 50%
+        eta_samples = array.array("d")   # interleaved (frac, elapsed) for the calibration fit
+        samples_cap = 2 * ETA_MAX_SAMPLES
+
+        def progress_cb(done: int, total: int, _time=time.time, _min=min, _max=max,
+                        _start=start_ts, _hint=eta_hint_f, _push=eta_samples.extend):
             nonlocal eta_smooth, eta_prev
 
             frac = (done / total) if total else 0.0
-            elapsed = time.time() - start_ts
+            elapsed = _time() - _start
+            if len(eta_samples) < samples_cap:
+                _push((frac, elapsed))
 
             # Two sources:
             # 1) model-based ETA: predicted - elapsed (robust early on)
-            eta_model = max(0.0, float(eta_hint) - elapsed)
-
+            eta_model = _max(0.0, _hint - elapsed)
             # 2) live ETA from progress (noisy at low progress)
-            if frac > 0.0:
-                eta_live = elapsed * (1.0 - frac) / max(frac, 1e-6)
-            else:
-                eta_live = float(eta_hint)
+            eta_live = elapsed * (1.0 - frac) / frac if frac > 1e-6 else _hint
 
-            # Blend: trust model first, switch to live by 50%.
-            # alpha = 0 at 15% → 1 at 50%
-            alpha = 0.0
-            if frac > 0.15:
-                alpha = min(1.0, (frac - 0.15) / 0.35)
+            # Blend: trust model first, switch to live by 50%
+            alpha = _min(1.0, _max(0.0, (frac - 0.15) * _blend_k))
+            eta_raw = eta_model + alpha * (eta_live - eta_model)
 
-            eta_raw = (1.0 - alpha) * eta_model + alpha * eta_live
-
-            # Exponential smoothing (EMA)
-            eta_smooth = 0.7 * eta_smooth + 0.3 * eta_raw
-
-            # Monotonic non-increasing display (avoid upward jumps)
-            eta_smooth = min(eta_smooth, eta_prev)
-            eta_prev = eta_smooth
+            # Exponential smoothing (EMA), monotonic non-increasing display (avoid upward jumps)
+            eta_smooth = eta_prev = _min(0.7 * eta_smooth + 0.3 * eta_raw, eta_prev)
 
             pct = int(frac * 100)
-            ui_eta = int(max(0.0, eta_smooth))
+            ui_eta = int(_max(0.0, eta_smooth))
 
-            def ui():
-                self.progress["value"] = pct
-                self.progress_label.set(_fmt_eta_text(pct, ui_eta))
-            self.after(0, ui)
+            # latest value wins; _drain_ui touches the widgets at most once per tick
+            with self._prog_lock:
+                self._prog_state = (pct, ui_eta)
 
 
         def _run():
@@ -1447,7 +2165,7 @@ class App(tk.Tk):
                 )
                 # финальное обновление калибровки
                 elapsed = time.time() - start_ts
-                eta_update_calibration_after_run(plies, depth, multipv, elapsed)
+                eta_update_calibration_after_run(plies, depth, multipv, elapsed, samples=eta_samples)
 
                 def ui_ok():
                     self.status_var.set("Ready. Analysis finished.")
@@ -1477,12 +2195,37 @@ class App(tk.Tk):
         return "edge" if self.tts_var.get().startswith("edge") else "sapi"
 
     def log(self, msg: str):
-        def append():
-            self.console.configure(state=tk.NORMAL)
-            self.console.insert(tk.END, msg + "\n")
-            self.console.see(tk.END)
-            self.console.configure(state=tk.DISABLED)
-        self.console.after(0, append)
+        self._ui_q.put(("log", msg))
+
+    _UI_BATCH = 500   # max queued updates applied per tick
+
+    def _drain_ui(self):
+        """One console insert and one progress update per tick, however many messages arrived."""
+        lines: List[str] = []
+        try:
+            for _ in range(self._UI_BATCH):
+                item = self._ui_q.get_nowait()
+                if item[0] == "log":
+                    lines.append(item[1])
+        except queue.Empty:
+            pass
+        with self._prog_lock:
+            progress = self._prog_state
+        if progress == self._prog_shown:
+            progress = None
+        try:
+            if lines:
+                self.console.configure(state=tk.NORMAL)
+                self.console.insert(tk.END, "\n".join(lines) + "\n")
+                self.console.see(tk.END)
+                self.console.configure(state=tk.DISABLED)
+            if progress is not None:
+                self._prog_shown = progress
+                pct, eta = progress
+                self.progress["value"] = pct
+                self.progress_label.set(_fmt_eta_text(pct, eta))
+        finally:
+            self.after(50, self._drain_ui)
 
     def start_loop(self):
         if self.worker and self.worker.is_alive():
@@ -1523,9 +2266,16 @@ class App(tk.Tk):
             super().destroy()
 
 def main():
-    import argparse
-    from pathlib import Path
     import sys
+
+    # GUI is the usual start: with no arguments at all skip argparse and the CLI imports
+    # (any argument, -h/--help included, goes through the parser as before)
+    if not sys.argv[1:]:
+        app = App()
+        app.mainloop()
+        return
+
+    import argparse
     import traceback
 
     parser = argparse.ArgumentParser(description="AI Chess Assistant — анализ PGN и режим 'what-if'")
@@ -1537,6 +2287,7 @@ def main():
     parser.add_argument("--jsonl", type=str, help="Путь к jsonl-файлу (для --whatif)")
     parser.add_argument("--ply", type=int, help="Номер полухода (для --whatif)")
     parser.add_argument("--san", type=str, help="Ход в SAN (для --whatif)")
+    parser.add_argument("--verbose", action="store_true", help="Полный traceback при ошибке")
     args, _ = parser.parse_known_args()
 
     # ---------- CLI-режим ----------
@@ -1557,7 +2308,10 @@ def main():
         except SystemExit:
             raise
         except Exception as e:
-            traceback.print_exc()
+            if args.verbose:
+                traceback.print_exc()
+            else:
+                print(f"Error: {type(e).__name__}: {e}", file=sys.stderr)
             sys.exit(1)
 
         return  # завершаем после CLI
@@ -1,5 +1,9 @@
+import bisect
+import re
 import unicodedata
-from typing import List, Tuple
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Set, Tuple
 
 # --- 1) Minimal Cyrillic→Latin map (ASCII only) ---
 _RU = {
@@ -9,15 +13,20 @@ _RU = {
     "щ":"shch","ъ":"","ы":"y","ь":"","э":"e","ю":"yu","я":"ya",
 }
 
+# str.translate takes multi-letter targets ("ж"→"zh") too, so one table covers the whole map
+_RU_TABLE = str.maketrans(_RU)
+
+@lru_cache(maxsize=2048)
 def ru2lat(s: str) -> str:
-    out = []
-    for ch in s:
-        lo = ch.lower()
-        out.append(_RU.get(lo, lo))
-    return "".join(out)
+    return s.lower().translate(_RU_TABLE)
 
 # --- 2) Core normalization ---
+# всё, кроме букв/цифр/пробелов (как not isalnum() and not isspace(); "_" входит в \w — исключаем явно)
+_NON_ALNUM = re.compile(r"[^\w\s]|_")
+
 def strip_accents(s: str) -> str:
+    if s.isascii():                # после ru2lat — почти всегда; NFKD для ASCII ничего не меняет
+        return s
     s = unicodedata.normalize("NFKD", s)
     return "".join(c for c in s if not unicodedata.combining(c))
 
@@ -26,31 +35,37 @@ def normalize_tokens(s: str) -> List[str]:
     s = s.strip().lower()
     s = ru2lat(s)                  # кириллица → латиница
     s = strip_accents(s)           # убираем диакритику (å→a, ø→o, æ→ae)
-    # убрать пунктуацию, оставить буквы/цифры/пробел
-    s = "".join(c if (c.isalnum() or c.isspace()) else " " for c in s)
-    s = " ".join(s.split())
-    return s.split()
+    # убрать пунктуацию, оставить буквы/цифры/пробел; split() сам схлопывает пробелы
+    return _NON_ALNUM.sub(" ", s).split()
 
 # --- 3) Heuristic RU→EN/NO variants ---
+# Common RU→EN/NO conflations, applied both ways
+_PHON_PAIRS = [
+    ("ule", "ole"), ("uli", "ole"), ("ulli", "ole"), ("uly", "ole"),
+    ("kristian", "christian"), ("kris", "chris"),
+    ("sergei", "sergey"), ("sergey", "sergej"),
+    ("alexey", "aleksei"), ("aleksey", "aleksei"), ("alexei", "aleksei"),
+    ("yuri", "yury"), ("yury", "juri"), ("mikhail", "michail"),
+    ("evgeny", "yevgeny"),
+]
+_PHON_MAP: Dict[str, Tuple[str, ...]] = {}
+for _a, _b in _PHON_PAIRS:
+    _PHON_MAP[_a] = _PHON_MAP.get(_a, ()) + (_b,)
+    _PHON_MAP[_b] = _PHON_MAP.get(_b, ()) + (_a,)
+_PHON_RE = re.compile("|".join(sorted(map(re.escape, _PHON_MAP), key=len, reverse=True)))
+del _a, _b
+
 def phonetic_rules(word: str) -> List[str]:
     """Return small set of likely variants for a single token."""
     w = word
     variants = {w}
 
-    # Common RU→EN/NO conflations
-    repl = [
-        ("ule", "ole"), ("uli", "ole"), ("ulli", "ole"), ("uly", "ole"),
-        ("kristian", "christian"), ("kris", "chris"),
-        ("sergei", "sergey"), ("sergey", "sergej"),
-        ("alexey", "aleksei"), ("aleksey", "aleksei"), ("alexei", "aleksei"),
-        ("yuri", "yury"), ("yury", "juri"), ("mikhail", "michail"),
-        ("evgeny", "yevgeny"),
-    ]
-    for a,b in repl:
-        if a in w:
-            variants.add(w.replace(a, b))
-        if b in w:
-            variants.add(w.replace(b, a))
+    # Common RU→EN/NO conflations: one regex pass decides whether any of them applies at all
+    if _PHON_RE.search(w):
+        for a, targets in _PHON_MAP.items():
+            if a in w:
+                for b in targets:
+                    variants.add(w.replace(a, b))
 
     # Norwegian letters already stripped (å→a, ø→o, æ→ae), но добавим ae→e
     if "ae" in w:
@@ -72,10 +87,11 @@ def phonetic_rules(word: str) -> List[str]:
 
     return list({v for v in variants if v})
 
-def make_name_keys(s: str) -> Tuple[str, List[str]]:
+@lru_cache(maxsize=4096)
+def make_name_keys(s: str) -> Tuple[str, Tuple[str, ...]]:
     """
     Build a primary key and a small bag of alternate tokens for fuzzy matching.
-    Returns (primary_key, alternates_list)
+    Returns (primary_key, alternates_tuple); cached — the same player names recur across games.
     """
     toks = normalize_tokens(s)
     # Generate alternates per token, keep top-N to avoid blow-up
@@ -85,7 +101,7 @@ def make_name_keys(s: str) -> Tuple[str, List[str]]:
     primary = " ".join(toks)
     # Dedup and cut
     alts = sorted(set(alts))[:20]
-    return primary, alts
+    return primary, tuple(alts)
 
 # --- 4) Matching ---
 def match_names(a: str, b: str) -> bool:
@@ -103,14 +119,74 @@ def match_names(a: str, b: str) -> bool:
     a_bag = set(a_key.split()) | set(a_alt)
     b_bag = set(b_key.split()) | set(b_alt)
 
-    # prefix overlap count
+    a_bag.discard(""); b_bag.discard("")
+
+    # exact token hits are prefix overlaps too — set intersection in C decides most pairs
+    if len(a_bag & b_bag) >= 2:
+        return True
+
+    # prefix overlap count: for each x, tokens of b starting with x form one range of the sorted bag,
+    # tokens of b that x starts with are x's own prefixes
+    b_sorted = sorted(b_bag)
     score = 0
     for x in a_bag:
-        for y in b_bag:
-            if not x or not y:
-                continue
-            if x.startswith(y) or y.startswith(x):
-                score += 1
-                if score >= 2:
-                    return True
+        lo = bisect.bisect_left(b_sorted, x)
+        score += bisect.bisect_left(b_sorted, x + "\U0010ffff", lo) - lo
+        score += sum(1 for k in range(1, len(x)) if x[:k] in b_bag)
+        if score >= 2:
+            return True
     return False
+
+# --- 5) One name against many: prefix tree over all token bags ---
+_END, _PASS = 0, 1   # служебные ключи узла (не строки — с буквами токенов не пересекаются)
+
+class PrefixIndex:
+    """
+    Prefix tree over the token bags of many names. A query name is matched against all of them
+    by walking each of its tokens once, with the same rules and result as match_names() per pair.
+    """
+    def __init__(self):
+        self.root: Dict[Any, Any] = {}
+        self.keys: Dict[Any, str] = {}   # owner -> primary key (правило подстроки)
+
+    def add(self, name: str, owner: Any = None) -> None:
+        owner = name if owner is None else owner
+        if owner in self.keys:
+            return                       # повторное добавление удвоило бы счётчики
+        key, alts = make_name_keys(name)
+        self.keys[owner] = key
+        for tok in set(key.split()) | set(alts):
+            if not tok:
+                continue
+            node = self.root
+            for c in tok:
+                node = node.setdefault(c, {})
+                node.setdefault(_PASS, Counter())[owner] += 1   # токены, начинающиеся с этого префикса
+            node.setdefault(_END, Counter())[owner] += 1        # токены, равные этому префиксу
+
+def build_index(names: Iterable[str]) -> PrefixIndex:
+    index = PrefixIndex()
+    for n in names:
+        index.add(n)
+    return index
+
+def match_against_index(name: str, index: PrefixIndex, min_overlaps: int = 2) -> Set[Any]:
+    """Owners in index that match_names() would match with name."""
+    key, alts = make_name_keys(name)
+    hits = {o for o, k in index.keys.items() if key in k or k in key}
+    score: Counter = Counter()
+    for tok in set(key.split()) | set(alts):
+        if not tok:
+            continue
+        node = index.root
+        last = len(tok)
+        for i, c in enumerate(tok, 1):
+            node = node.get(c)
+            if node is None:
+                break
+            if i < last:
+                score.update(node.get(_END, ()))   # токены индекса — собственные префиксы tok
+            else:
+                score.update(node[_PASS])          # токены индекса, начинающиеся с tok
+    hits.update(o for o, n in score.items() if n >= min_overlaps)
+    return hits
@@ -1,5 +1,7 @@
 from __future__ import annotations
 from typing import Dict, Any, Optional
+import functools
+import re
 import chess
 from chess.engine import Score, PovScore
 from collections.abc import Mapping
@@ -8,6 +10,7 @@ from engine_core import analyse_with_phase
 from helpers import make_prompt as make_sf_prompt
 from llm_util import ask
 from kb import auto_query
+import eval_cache
 
 
 try:
@@ -16,11 +19,11 @@ except Exception:
     kb_get_advice_for_fen = None
 
 def make_plan_for_fen(fen: str, depth: int = 18) -> Dict[str, Any]:
-    try:
-        from kb import kb_get_advice_for_fen
-        return kb_get_advice_for_fen(fen, depth=depth)
-    except Exception:
-        pass
+    if kb_get_advice_for_fen is not None:
+        try:
+            return kb_get_advice_for_fen(fen, depth=depth)
+        except Exception:
+            pass
 
     # Фолбэк: старый планер → приводим к новой схеме
     base = plan_for_fen(fen)
@@ -101,6 +104,13 @@ def _format_eval_generic(score: Score | PovScore | None, turn: chess.Color) -> s
     """Форматтер, дружелюбный к разным типам score и версиям python-chess."""
     if score is None:
         return "0.00"
+    if type(score) is PovScore:
+        # обычный случай (analyse от python-chess) — без рефлексии
+        s = score.pov(turn)
+        m = s.mate()
+        if m is not None:
+            return f"M{abs(m)}"
+        return f"{(s.score() or 0)/100.0:+.2f}"
     try:
         pov = getattr(score, "pov", None)
         s = pov(turn) if callable(pov) else score
@@ -124,14 +134,14 @@ def _format_eval_generic(score: Score | PovScore | None, turn: chess.Color) -> s
         return "0.00"
 
 
+# границы строк — те же, что у str.splitlines()
+_RE_LINE_BREAK = re.compile("[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+
 def _first_nonempty_line(s: str | None) -> str:
-    if not s:
-        return ""
-    for line in s.splitlines():
-        t = line.strip()
-        if t:
-            return t
-    return ""
+    # lstrip пропускает пустые строки целиком; дальше режем только первую строку, без списка всех строк
+    t = s.lstrip() if s else ""
+    m = _RE_LINE_BREAK.search(t)
+    return (t[:m.start()] if m else t).rstrip()
 
 def side_ru(turn: bool) -> str:
     return "Белых" if turn else "Чёрных"
@@ -150,14 +160,10 @@ def _pick_examples(rows, max_n=3):
     for r in rows[:max_n]:
         # Ожидаемый формат:
         # (fen, phase, comment, white, black, result, eco, opening, is_mainline, ply, nags?) — последние поля опциональны
-        fen = r[0] if len(r) > 0 else ""
-        phase = r[1] if len(r) > 1 else ""
-        comment = r[2] if len(r) > 2 else ""
-        w = r[3] if len(r) > 3 else ""
-        b = r[4] if len(r) > 4 else ""
-        result = r[5] if len(r) > 5 else ""
-        eco = r[6] if len(r) > 6 else ""
-        opening = r[7] if len(r) > 7 else ""
+        r = tuple(r)
+        if len(r) < 8:
+            r += ("",) * (8 - len(r))
+        fen, _phase, comment, w, b, result, eco, opening = r[:8]
         title = f"{(w or '').strip()}–{(b or '').strip()} {(result or '').strip()}".strip(" –")
         info = " ".join(x for x in [eco or "", opening or ""] if x).strip()
         snippet = _first_nonempty_line(comment)[:160]
@@ -165,6 +171,28 @@ def _pick_examples(rows, max_n=3):
     return out
 # ──────────────────────────────────────────────────────────────────────────
 
+@functools.lru_cache(maxsize=256)
+def _auto_query_cached(fen: str) -> dict:
+    # только в памяти: база пересобирается build_base, между запусками кэш устарел бы
+    return auto_query(fen, limit=8)
+
+_BASE_PROMPT_TEMPLATE = (
+    "Ты тренер. Сторона на ходу: {who}. Ход-кандидат по движку: {best}.\n"
+    "Главный ресурс соперника (первый ответ): {opp_line}.\n"
+    "Сформулируй ответ строго в 4 пункта, по-русски и без англицизмов:\n"
+    "1) Ход-кандидат(ы): коротко и по делу.\n"
+    "2) План: 1–2 ключевые идеи (манёвры, куда ставим фигуры, какие линии вскрываем/закрываем).\n"
+    "3) Идеи соперника: одна главная контригра и как её сдержать.\n"
+    "4) Подводные камни: 1 типовая ошибка и чем она плоха.\n"
+    "Не пиши длинных вариантов. Если примеры помогают, сошлись на них кратко.\n\n"
+)
+
+def _render_example(ex: dict) -> str:
+    line = f"• {ex['title']}"
+    if ex['info']: line += f" ({ex['info']})"
+    if ex['comment']: line += f": {ex['comment']}"
+    return line
+
 def plan_for_fen(fen: str, multipv_open=3) -> dict:
     """Главная функция. Возвращает словарь с ключами:
        phase, sf_lines, examples, advice
@@ -187,10 +215,11 @@ def plan_for_fen(fen: str, multipv_open=3) -> dict:
     except Exception:
         phase = "middlegame"
 
-    # 2) Анализ движка (устойчиво)
+    # 2) Анализ движка (устойчиво); та же позиция при повторных «а что если» — из кэша
     info = []
     try:
-        raw = analyse_with_phase(board, phase, multipv_open=multipv_open)
+        key = eval_cache.make_key("plan_sf", board, phase, multipv_open)
+        raw = eval_cache.cached(key, lambda: analyse_with_phase(board, phase, multipv_open=multipv_open))
         info = raw if isinstance(raw, list) else [raw]
     except Exception:
         info = []
@@ -198,7 +227,7 @@ def plan_for_fen(fen: str, multipv_open=3) -> dict:
     # 3) Локальная БД (устойчиво)
     examples = []
     try:
-        q = auto_query(fen, limit=8)
+        q = _auto_query_cached(fen)
         rows = q.get("rows", []) if isinstance(q, dict) else []
         examples = _pick_examples(rows, max_n=3)
     except Exception:
@@ -207,47 +236,32 @@ def plan_for_fen(fen: str, multipv_open=3) -> dict:
     # 4) Сборка строк SF (устойчиво к пустым pv/score)
     sf_lines = []
     try:
-        btmp = chess.Board(fen)
         for d in info:
             pv_moves = _field(d, "pv") or []
             try:
-                pv_san = btmp.variation_san(pv_moves[:5]) if pv_moves else "(нет pv)"
+                pv_san = board.variation_san(pv_moves[:5]) if pv_moves else "(нет pv)"
             except Exception:
                 pv_san = "(не удалось сформировать pv)"
             sc = _field(d, "score", None)
-            ev = _format_eval_generic(sc, btmp.turn) if sc is not None else "0.00"
+            ev = _format_eval_generic(sc, board.turn) if sc is not None else "0.00"
             sf_lines.append(f"{pv_san}  (eval {ev})")
     except Exception:
         sf_lines = []
     
         # --- вместо старого блока с base_prompt/prompt/ask() — точечная сборка текста ---
-    who = "Белых" if board.turn else "Чёрных"
-    best = _best_move_san_from_info(fen, info)
-    opp  = _counter_idea_from_info(fen, info)
-    trap = _trap_from_alt_line(fen, info)
+    who = side_ru(board.turn)
+    best = _best_move_san_from_info(board, info)
+    opp  = _counter_idea_from_info(board, info)
+    trap = _trap_from_alt_line(board, info)
 
     # соберём вводные для LLM (короче и конкретнее)
     ex_text = ""
     if examples:
-        bullets = []
-        for ex in examples:
-            line = f"• {ex['title']}"
-            if ex['info']: line += f" ({ex['info']})"
-            if ex['comment']: line += f": {ex['comment']}"
-            bullets.append(line)
-        ex_text = "Примеры (кратко):\n" + "\n".join(bullets) + "\n\n"
-
-    base_prompt = (
-        f"Ты тренер. Сторона на ходу: {who}. Ход-кандидат по движку: {best}.\n"
-        f"Главный ресурс соперника (первый ответ): {opp if opp!='—' else 'невыражен'}.\n"
-        "Сформулируй ответ строго в 4 пункта, по-русски и без англицизмов:\n"
-        "1) Ход-кандидат(ы): коротко и по делу.\n"
-        "2) План: 1–2 ключевые идеи (манёвры, куда ставим фигуры, какие линии вскрываем/закрываем).\n"
-        "3) Идеи соперника: одна главная контригра и как её сдержать.\n"
-        "4) Подводные камни: 1 типовая ошибка и чем она плоха.\n"
-        "Не пиши длинных вариантов. Если примеры помогают, сошлись на них кратко.\n\n"
-        + ex_text
-    )
+        ex_text = "Примеры (кратко):\n" + "\n".join(_render_example(ex) for ex in examples) + "\n\n"
+
+    base_prompt = _BASE_PROMPT_TEMPLATE.format(
+        who=who, best=best, opp_line=opp if opp != '—' else 'невыражен'
+    ) + ex_text
     try:
         if info:
             prompt = base_prompt + make_sf_prompt(board, info, phase)
@@ -271,9 +285,7 @@ def plan_for_fen(fen: str, multipv_open=3) -> dict:
         "advice": advice_text
     }
 
-def _best_move_san_from_info(fen: str, info_list) -> str:
-    import chess
-    b = chess.Board(fen)
+def _best_move_san_from_info(b: chess.Board, info_list) -> str:
     if not info_list: return "—"
     pv = (info_list[0].get("pv") or [])
     if not pv: return "—"
@@ -283,13 +295,12 @@ def _best_move_san_from_info(fen: str, info_list) -> str:
         san = pv[0].uci() if pv else "—"
     return san
 
-def _counter_idea_from_info(fen: str, info_list) -> str:
+def _counter_idea_from_info(board: chess.Board, info_list) -> str:
     # «главный ресурс соперника» = первый ответный ход в лучшем PV
-    import chess
-    b = chess.Board(fen)
     if not info_list: return "—"
     pv = (info_list[0].get("pv") or [])
     if len(pv) < 2: return "—"
+    b = board.copy(stack=False)   # ход делаем на копии
     try:
         b.push(pv[0])
         san_reply = b.san(pv[1])
@@ -297,26 +308,35 @@ def _counter_idea_from_info(fen: str, info_list) -> str:
         san_reply = pv[1].uci()
     return san_reply
 
-def _trap_from_alt_line(fen: str, info_list) -> str | None:
+def _cp_for_turn(sc, turn: chess.Color) -> float:
+    """cp с точки зрения turn; мат — как очень большая оценка, неизвестное — 0."""
+    if sc is None:
+        return 0.0
+    if isinstance(sc, (PovScore, Score)):
+        # обычный случай — python-chess, без try/except
+        s = sc.pov(turn) if isinstance(sc, PovScore) else sc
+        m = s.mate()
+        if m is not None:
+            return 10000.0 if m > 0 else -10000.0
+        c = s.score()
+        return float(c) if c is not None else 0.0
+    try:
+        if hasattr(sc, "pov"): sc = sc.pov(turn)
+        m = sc.mate()
+        if m is not None:
+            return 10000.0 if m > 0 else -10000.0
+        return float(sc.score() or 0)
+    except Exception:
+        return 0.0
+
+def _trap_from_alt_line(b: chess.Board, info_list) -> str | None:
     # если у второй линии eval значительно хуже (например, хуже на ≥ 0.7 пешки),
     # покажем «подводный камень»: первый ход альтернативы
-    import chess
     if len(info_list) < 2: return None
-    b = chess.Board(fen)
     pv2 = info_list[1].get("pv") or []
     s1 = info_list[0].get("score")
     s2 = info_list[1].get("score")
-    def cp(sc):
-        try:
-            if hasattr(sc, "pov"): sc = sc.pov(b.turn)
-            m = sc.mate()
-            if m is not None:
-                # трактуем мат как очень большую оценку
-                return 10000 if m > 0 else -10000
-            return float(sc.score() or 0)
-        except Exception:
-            return 0.0
-    if pv2 and (cp(s1) - cp(s2) >= 70):  # 0.70 пешки
+    if pv2 and (_cp_for_turn(s1, b.turn) - _cp_for_turn(s2, b.turn) >= 70):  # 0.70 пешки
         try:
             bad = b.san(pv2[0])
         except Exception:
@@ -4,6 +4,7 @@
 
 from __future__ import annotations
 import re
+import functools
 import chess
 
 __all__ = [
@@ -17,31 +18,66 @@ FILE_RU = {"a":"а", "b":"бэ", "c":"це", "d":"дэ", "e":"е", "f":"эф", "
 DIGIT_RU = {"1":"один", "2":"два", "3":"три", "4":"четыре", "5":"пять", "6":"шесть", "7":"семь", "8":"восемь"}
 PIECE_RU = {"K":"король", "Q":"ферзь", "R":"ладья", "B":"слон", "N":"конь", "P":""}
 
-_RE_NUM = re.compile(r"^\d+\.{0,3}$")     # 1. 1... 12 ..
-_RE_ELLIPSIS = re.compile(r"^\.\.\.$")
+
+# san_to_speech
+_RE_ANNOT = re.compile(r"[!?]+")
+_RE_PROMO = re.compile(r"=([QRBN])")
+_RE_SAN_DISAMB = re.compile(r"([KQRBN])?([a-h1-8])?x?([a-h][1-8])")
+_RE_SQUARE_HEAD = re.compile(r"([a-h][1-8])")
+# well-formed SAN in one pass (annotations already removed); anything else goes the step-by-step way.
+# Also the SAN test for opening-title tails, so both paths accept the same moves.
+_RE_SAN_FULL = re.compile(
+    r"(?P<piece>[KQRBN])?(?P<disamb>[a-h1-8])?(?P<cap>x)?(?P<to>[a-h][1-8])"
+    r"(?:=(?P<promo>[QRBN]))?(?P<check>[+#])?"
+)
+_CHECK_RU = {"+": "шах", "#": "мат"}
+# whole promotion phrase, piece in the accusative ("в ферзя", not "в ферзь")
+_PROMO_RU = {
+    "Q": "с превращением в ферзя", "R": "с превращением в ладью",
+    "B": "с превращением в слона", "N": "с превращением в коня",
+}
+
+# opening_title_to_speech (ECO tails)
+_RE_T_SQ   = re.compile(r"^[a-h][1-8]$", re.IGNORECASE)
+# one classifier per tail token (title tail and moves line): castling | SAN (case-sensitive) | bare square
+_RE_T_TOKEN = re.compile(
+    r"(?P<cast>(?i:O-O-O|O-O|0-0-0|0-0))"
+    r"|(?P<san>" + _RE_SAN_FULL.pattern + r")"
+    r"|(?P<sq>(?i:[a-h][1-8]))"
+)
+_RE_WS = re.compile(r"\s+")
+
+# apply_san_sequence / strip_move_numbers
+_COMMA_TO_SPACE = str.maketrans({",": " "})
+_RE_MOVENUM = re.compile(r"\d+\.{0,3}|\.\.\.")
+_FILES = frozenset("abcdefgh")
+_RANKS = frozenset("12345678")
+_PROMOS = frozenset("qrbn")
+
+# All 64 squares spoken, built once: 'g3' → 'же три'
+_SQ_RU = {f + d: f"{FILE_RU[f]} {DIGIT_RU[d]}" for f in FILE_RU for d in DIGIT_RU}
 
 def coord_to_ru(sq: str) -> str:
     """Translate 'g3' → 'же три' (simple coordinate)."""
-    sq = sq.strip().lower()
-    if len(sq) != 2 or sq[0] not in FILE_RU or sq[1] not in DIGIT_RU:
-        return sq
-    return f"{FILE_RU[sq[0]]} {DIGIT_RU[sq[1]]}"
-
-def _clean_token(tok: str) -> str:
-    tok = tok.strip()
-    if _RE_NUM.match(tok) or _RE_ELLIPSIS.match(tok):
-        return ""
-    return tok
+    spoken = _SQ_RU.get(sq)   # canonical 'g3' from SAN/regex groups: no strip/lower copies
+    if spoken is None:
+        sq = sq.strip().lower()
+        spoken = _SQ_RU.get(sq, sq)
+    return spoken
+
+def _is_uci(t: str) -> bool:
+    """e2e4 / e7e8q shape (lowercase), without the regex engine."""
+    n = len(t)
+    return ((n == 4 or (n == 5 and t[4] in _PROMOS))
+            and t[0] in _FILES and t[1] in _RANKS and t[2] in _FILES and t[3] in _RANKS)
+
+def _variant_tokens(text: str) -> list[str]:
+    # commas → spaces in one translate pass, then drop 1. / 1... / '...' tokens
+    return [t for t in text.translate(_COMMA_TO_SPACE).split() if not _RE_MOVENUM.fullmatch(t)]
 
 def strip_move_numbers(text: str) -> str:
     """Remove 1., 1... and '...' from a raw variant sentence."""
-    toks = re.split(r"(\s+|,)", text)
-    out = []
-    for t in toks:
-        if _clean_token(t) == "":
-            continue
-        out.append(t)
-    return "".join(out)
+    return " ".join(_variant_tokens(text))
 
 def _take_piece_letter(san: str) -> str:
     # SAN starts with piece letter or file letter; castling handled elsewhere.
@@ -50,8 +86,9 @@ def _take_piece_letter(san: str) -> str:
     return "P"
 
 def _square_to_ru(square: chess.Square) -> str:
-    return coord_to_ru(chess.square_name(square))
+    return _SQ_RU[chess.square_name(square)]
 
+@functools.lru_cache(maxsize=4096)  # чистая функция от строки: ход озвучивается одинаково
 def san_to_speech(san: str) -> str:
     """
     Convert a SAN like 'Nf3', 'Bxb5+', 'exd5', 'O-O', 'c8=Q#' to Russian speech:
@@ -66,11 +103,26 @@ def san_to_speech(san: str) -> str:
         return "длинная рокировка"
 
     # Remove annotations like !? etc.
-    san_core = re.sub(r"[!?]+", "", san)
+    san_core = _RE_ANNOT.sub("", san)
+
+    m = _RE_SAN_FULL.fullmatch(san_core)
+    if m:
+        piece, promo, check = m.group("piece", "promo", "check")
+        segs = []
+        if piece:
+            segs.append(PIECE_RU[piece])
+        if m.group("cap"):
+            segs.append("бьёт")
+        segs.append(_SQ_RU[m.group("to")])
+        if promo:
+            segs.append(_PROMO_RU[promo])
+        if check:
+            segs.append(_CHECK_RU[check])
+        return " ".join(segs)
 
     # Promotions c8=Q#
     promo = None
-    m = re.search(r"=([QRBN])", san_core)
+    m = _RE_PROMO.search(san_core)
     if m:
         promo = m.group(1)
         san_core = san_core.replace(f"={promo}", "")
@@ -85,7 +137,7 @@ def san_to_speech(san: str) -> str:
         san_core = san_core[:-1]
 
     # Disambiguation like Nbd2 or R1e1
-    m = re.match(r"([KQRBN])?([a-h1-8])?x?([a-h][1-8])", san_core)
+    m = _RE_SAN_DISAMB.match(san_core)
     capture = "x" in san_core
     piece = _take_piece_letter(san_core)
     if m:
@@ -101,17 +153,17 @@ def san_to_speech(san: str) -> str:
             segs.append("бьёт")
         segs.append(to_ru)
         if promo:
-            segs.append(f"с превращением в {PIECE_RU[promo] or 'ферзя'}".strip())
+            segs.append(_PROMO_RU[promo])
         if tail:
             segs.extend(tail)
-        return " ".join(segs).replace("  ", " ").strip()
+        return " ".join(segs)  # no empty segments: piece_ru is guarded, the rest are fixed words
 
     # Pawn quiet move like 'e4'
-    m2 = re.match(r"([a-h][1-8])", san_core)
+    m2 = _RE_SQUARE_HEAD.match(san_core)
     if m2:
         res = coord_to_ru(m2.group(1))
         if promo:
-            res += f" с превращением в {PIECE_RU[promo] or 'ферзя'}"
+            res += " " + _PROMO_RU[promo]
         if tail:
             res += " " + " ".join(tail)
         return res
@@ -121,8 +173,42 @@ def san_to_speech(san: str) -> str:
 
 def pv_to_speech(pv_sans: list[str]) -> str:
     """List of SAN → one readable sentence."""
-    words = [san_to_speech(s) for s in pv_sans]
-    return ", ".join(words)
+    return _pv_tuple_to_speech(tuple(pv_sans))
+
+@functools.lru_cache(maxsize=1024)  # the same short PV is re-announced while the engine deepens
+def _pv_tuple_to_speech(pv: tuple[str, ...]) -> str:
+    return ", ".join(map(san_to_speech, pv))
+
+# Helper: RU letters → SAN letters for pieces (rough but good for ECO tails)
+# Cyrillic letters commonly found in ECO tails:
+# С(slоn)→B, К(kon')→N, Л(lad'ya)→R, Ф(ferz')→Q — one translate pass
+_RU_FIG_TABLE = str.maketrans({"С": "B", "с": "B", "К": "N", "к": "N",
+                               "Л": "R", "л": "R", "Ф": "Q", "ф": "Q"})
+# castling written with Cyrillic О (only inside О-О / о-о, a lone "о" stays as is)
+_RE_RU_CASTLE = re.compile(r"О-О(?:-О)?|о-о(?:-о)?")
+
+def _ru_fig_to_en(tok: str) -> str:
+    tok = tok.translate(_RU_FIG_TABLE)
+    if "-" in tok:
+        tok = _RE_RU_CASTLE.sub(lambda m: "O-O-O" if len(m.group()) == 5 else "O-O", tok)
+    return tok
+
+# Decide correct gender for the verb based on the Russian opening name.
+# Masculine: "гамбит", "дебют", "вариант" => "был сыгран"
+# Feminine:  "защита", "система", "атака", "партия" => "была сыграна"
+# Neuter:    "начало" => "было сыграно"
+# (the noun is often not the first word — "Сицилианская защита" — so search the whole head)
+_FEM_KEYS = ("защита", "система", "атака", "партия")
+_NEUT_KEYS = ("начало",)
+
+def _verb_for_title(head_ru: str) -> str:
+    h = (head_ru or "").strip().lower()
+    if any(k in h for k in _FEM_KEYS):
+        return "была сыграна"
+    if any(k in h for k in _NEUT_KEYS):
+        return "было сыграно"
+    # default to masculine (covers most cases)
+    return "был сыгран"
 
 def opening_title_to_speech(title_ru: str, moves_line: str | list[str] | None = None) -> str:
     """
@@ -131,6 +217,35 @@ def opening_title_to_speech(title_ru: str, moves_line: str | list[str] | None =
     castling, and 'без g6' → 'без же шесть'.
     Fallback: if title has no moves, use moves_line.
     """
+    head, verb, spoken = _title_head_and_moves(title_ru)
+    # Fallback to moves_line if title had no usable moves
+    if not spoken and moves_line:
+        if isinstance(moves_line, list):
+            moves_line = tuple(moves_line)   # hashable for the cache
+        spoken = _moves_line_spoken(moves_line)
+
+    # Build final phrase with correct gender
+    tail_text = ", ".join(spoken) if spoken else ""
+    if tail_text:
+        return f"У вас в партии {verb} {head}: {tail_text}"
+    else:
+        return f"У вас в партии {verb} {head}"
+
+def _tail_token_to_speech(t: str) -> str | None:
+    """One move token of a title tail / moves line → speech; None for words and numbers."""
+    m = _RE_T_TOKEN.fullmatch(t)
+    if m is None:
+        return None
+    kind = m.lastgroup
+    if kind == "cast":
+        return san_to_speech("O-O-O" if len(t) == 5 else "O-O")
+    if kind == "san":
+        return san_to_speech(t)
+    return coord_to_ru(t)
+
+@functools.lru_cache(maxsize=1024)
+def _title_head_and_moves(title_ru: str) -> tuple[str, str, tuple[str, ...]]:
+    """(head, verb, spoken moves of the title's own tail) — depends on the title only."""
     title_full = (title_ru or "").strip().rstrip(".")
     head = title_full
     tail = ""
@@ -141,121 +256,50 @@ def opening_title_to_speech(title_ru: str, moves_line: str | list[str] | None =
         head = parts[0].strip()
         tail = parts[1].strip()
 
-    # Helper: RU letters → SAN letters for pieces (rough but good for ECO tails)
-    def _ru_fig_to_en(tok: str) -> str:
-        # Cyrillic letters commonly found in ECO tails:
-        # С(slоn)→B, К(kon')→N, Л(lad'ya)→R, Ф(ferz')→Q; also normalize castling
-        rep = (
-            ("С", "B"), ("с", "B"),
-            ("К", "N"), ("к", "N"),
-            ("Л", "R"), ("л", "R"),
-            ("Ф", "Q"), ("ф", "Q"),
-            ("О-О-О", "O-O-O"), ("о-о-о", "O-O-O"),
-            ("О-О", "O-O"),     ("о-о", "O-O"),
-        )
-        for a, b in rep:
-            tok = tok.replace(a, b)
-        return tok
-
     # Tokenize the tail; allow commas and multiple spaces
     tokens = []
     if tail:
         # drop commas to simplify, keep '...g6' intact
         raw = tail.replace(",", " ")
-        tokens = [t for t in re.split(r"\s+", raw) if t]
+        tokens = [t for t in _RE_WS.split(raw) if t]
 
     spoken = []
-    # Decide correct gender for the verb based on the Russian opening name.
-    # Masculine: "гамбит", "дебют", "вариант" => "был сыгран"
-    # Feminine:  "защита", "система", "атака", "партия" => "была сыграна"
-    # Neuter:    "начало" => "было сыграно"
-    def _verb_for_title(head_ru: str) -> str:
-        h = (head_ru or "").strip().lower()
-        fem_keys = ("защита", "система", "атака", "партия")
-        masc_keys = ("гамбит", "дебют", "вариант")
-        neut_keys = ("начало",)
-        if any(k in h for k in fem_keys):
-            return "была сыграна"
-        if any(k in h for k in neut_keys):
-            return "было сыграно"
-        # default to masculine (covers most cases)
-        return "был сыгран"
-
-    bez_square = None
     want_bez = False
-    # Patterns
-    re_num   = re.compile(r"^\d+\.?$")
-    re_cast  = re.compile(r"^(O-O(-O)?|0-0(-0)?)$", re.IGNORECASE)
-    re_san   = re.compile(r"^[KQRBN]?[a-h]x?[a-h][1-8][+#]?$", re.IGNORECASE)
-    re_sq    = re.compile(r"^[a-h][1-8]$", re.IGNORECASE)
-    re_ell   = re.compile(r"^\.\.\.([a-h][1-8])$", re.IGNORECASE)
-
     for t in tokens:
         t0 = t.strip().strip(".")
         if not t0:
             continue
 
-        # 'без' handler — pick the next square ('g6' or '...g6')
+        # 'без' handler — the next token is the square ('g6' or '...g6')
         if want_bez:
-            m = re_ell.match(t0)
-            if m:
-                bez_square = m.group(1).lower()
-            elif re_sq.match(t0):
-                bez_square = t0.lower()
             want_bez = False
+            if _RE_T_SQ.match(t0):
+                spoken.append("без " + coord_to_ru(t0))
             continue
-
         if t0.lower() == "без":
             want_bez = True
             continue
-        if t0 in ("...", "…") or re_num.match(t0):
-            continue
-
-        # Normalize russian letters to SAN letters before recognition
-        t1 = _ru_fig_to_en(t0)
-        if not (re_cast.match(t1) or re_san.match(t1) or re_sq.match(t1) or re_ell.match(t1) or t0.lower() == "без"):
-            continue
 
-        # Recognize and speak
-        if re_cast.match(t1):
-            spoken.append(san_to_speech("O-O-O" if "O-O-O" in t1 or "0-0-0" in t1 else "O-O"))
-        elif re_san.match(t1):
-            spoken.append(san_to_speech(t1))
-        elif re_sq.match(t1):
-            spoken.append(coord_to_ru(t1))
-        else:
-            m = re_ell.match(t1)  # e.g. '...g6'
-            if m:
-                spoken.append(coord_to_ru(m.group(1).lower()))
-            # otherwise skip unknown fragments like words
+        # Normalize russian letters to SAN letters, then classify in one match;
+        # move numbers, '…' and words match nothing and are skipped
+        said = _tail_token_to_speech(_ru_fig_to_en(t0))
+        if said:
+            spoken.append(said)
 
-    # Fallback to moves_line if title had no usable moves
-    if not spoken and moves_line:
-        if isinstance(moves_line, str):
-            ml = strip_move_numbers(moves_line)
-            toks = [t for t in re.split(r"[,\s]+", ml) if t]
-        else:
-            toks = list(moves_line)
-        for t in toks:
-            t = t.strip(".")
-            if re_cast.match(t):
-                spoken.append(san_to_speech("O-O-O" if "O-O-O" in t or "0-0-0" in t else "O-O"))
-            elif re_san.match(t):
-                spoken.append(san_to_speech(t))
-            elif re_sq.match(t):
-                spoken.append(coord_to_ru(t))
-            elif re_ell.match(t):
-                m = re_ell.match(t)
-                if m:
-                    spoken.append(coord_to_ru(m.group(1).lower()))
+    return head, _verb_for_title(head), tuple(spoken)
 
-    # Build final phrase with correct gender
-    tail_text = ", ".join(spoken) if spoken else ""
-    verb = _verb_for_title(head)
-    if tail_text:
-        return f"У вас в партии {verb} {head}: {tail_text}"
+@functools.lru_cache(maxsize=1024)
+def _moves_line_spoken(moves_line: str | tuple[str, ...]) -> tuple[str, ...]:
+    spoken = []
+    if isinstance(moves_line, str):
+        toks = _variant_tokens(moves_line)
     else:
-        return f"У вас в партии {verb} {head}"
+        toks = list(moves_line)
+    for t in toks:
+        said = _tail_token_to_speech(t.strip("."))
+        if said:
+            spoken.append(said)
+    return tuple(spoken)
 
 
 # ---------- Variant parsing for 'what-if' ----------
@@ -267,22 +311,22 @@ def apply_san_sequence(board: chess.Board, text: str) -> list[chess.Move]:
     - Tries SAN first, then UCI
     Returns the list of legal moves applied (raises ValueError with message on failure).
     """
-    raw = strip_move_numbers(text)
-    tokens = [t.strip(",") for t in raw.split() if t.strip(",")]
-    b = board.copy()
+    tokens = _variant_tokens(text)
+    # legality needs no move history: skip copying the stack (caller's board stays untouched)
+    b = board.copy(stack=False)
     out: list[chess.Move] = []
     for tok in tokens:
         # SAN first
         try:
-            mv = b.parse_san(tok)
-            b.push(mv); out.append(mv); continue
-        except Exception:
+            out.append(b.push_san(tok)); continue
+        except ValueError:   # invalid / illegal / ambiguous SAN
             pass
         # UCI next: e2e4, g1f3, with optional promotion
-        if re.match(r"^[a-h][1-8][a-h][1-8][qrbn]?$", tok.lower()):
+        low = tok.lower()
+        if _is_uci(low):
             try:
-                mv = chess.Move.from_uci(tok.lower())
-                if mv in b.legal_moves:
+                mv = chess.Move.from_uci(low)
+                if b.is_legal(mv):
                     b.push(mv); out.append(mv); continue
             except Exception:
                 pass